@@ -0,0 +1,81 @@
+#!/usr/bin/env python3.10
+#
+# compare the pdf text extraction backends used by doc2quiz --pdf_backend
+#
+# usage: pdf_backend_benchmark.py [pdf_filename] [max_pages]
+#
+import sys
+import time
+import resource
+import difflib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from prettytable import PrettyTable
+
+from doc2quiz.PdfExtractor import backends, get_extractor
+
+
+def run_backend(backend, pdf_filename, max_pages):
+    """
+    extract pages with one backend. runs in a fresh process so ru_maxrss is the
+    peak rss of that backend alone.
+    """
+    start = time.perf_counter()
+    with get_extractor(backend, pdf_filename) as extractor:
+        num_pages = min(extractor.page_count, max_pages) if max_pages else extractor.page_count
+        texts = [extractor.extract_page(page_num) for page_num in range(num_pages)]
+    elapsed = time.perf_counter() - start
+    # linux reports kilobytes, macos reports bytes
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024
+    return texts, elapsed, peak_rss
+
+
+def text_similarity(text_a, text_b):
+    """
+    word level similarity, whitespace and line breaks differ a lot between engines
+    and don't change what the llm reads
+    """
+    return difflib.SequenceMatcher(None, text_a.split(), text_b.split(), autojunk=False).ratio()
+
+
+def compare_outputs(results):
+    names = list(results)
+    reference = names[0]
+    ref_texts = results[reference][0]
+    table = PrettyTable()
+    table.field_names = ["Backend", "Words", "Similarity to " + reference, "Worst page", "Worst similarity"]
+    for name in names:
+        texts = results[name][0]
+        scores = [text_similarity(a, b) for a, b in zip(ref_texts, texts)]
+        worst_page = min(range(len(scores)), key=scores.__getitem__) if scores else 0
+        mean_score = sum(scores) / len(scores) if scores else 1.0
+        num_words = sum(len(text.split()) for text in texts)
+        table.add_row([name, num_words, f"{mean_score:.3f}", worst_page + 1,
+                       f"{scores[worst_page]:.3f}" if scores else "-"])
+    return table
+
+
+def main():
+    pdf_filename = sys.argv[1] if len(sys.argv) > 1 else "inputs/pdf/book.pdf"
+    max_pages = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for backend in backends:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[backend] = executor.submit(run_backend, backend, pdf_filename, max_pages).result()
+
+    table = PrettyTable()
+    table.field_names = ["Backend", "Pages", "Seconds", "Pages/sec", "Peak RSS (MB)"]
+    table.align["Backend"] = "l"
+    for backend, (texts, elapsed, peak_rss) in results.items():
+        pages_per_sec = len(texts) / elapsed if elapsed else 0
+        table.add_row([backend, len(texts), f"{elapsed:.2f}", f"{pages_per_sec:.1f}", f"{peak_rss / 1024:.1f}"])
+    print(table)
+    print(compare_outputs(results))
+
+
+if __name__ == "__main__":
+    main()
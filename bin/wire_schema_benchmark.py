@@ -0,0 +1,87 @@
+#!/usr/bin/env python3.10
+#
+# measure the output token (and optionally latency) savings of --wire_schema compact
+#
+# usage: wire_schema_benchmark.py [chapter.yaml] [--live chapter.txt] [--model gpt-4o-mini]
+#
+import sys
+import json
+import time
+import argparse
+from prettytable import PrettyTable
+from pydantic_yaml import parse_yaml_raw_as
+
+from doc2quiz.Quiz import Quiz
+from doc2quiz.QuizWire import quiz_to_wire, wire_to_quiz
+from doc2quiz.ExampleYaml import example_yaml
+from doc2quiz.Tokens import count_tokens
+from doc2quiz.Utils import Config
+
+
+def measure_tokens(quiz, model):
+    """
+    tokens of the json the llm would have to generate for each schema, plus a lossless round trip check
+    """
+    wire = quiz_to_wire(quiz)
+    full_json = json.dumps(quiz.model_dump(exclude_none=True))
+    compact_json = json.dumps(wire.model_dump(mode="json", exclude_none=True))
+    lossless = wire_to_quiz(wire) == quiz
+    return count_tokens(full_json, model), count_tokens(compact_json, model), lossless
+
+
+def measure_live(txt_file, model):
+    """
+    ask for the same chapter with both schemas and time the requests
+    """
+    from doc2quiz.Txt2Yaml import Txt2Yaml
+
+    with open(txt_file, 'r', encoding='utf-8') as file:
+        text = file.read()
+    rows = []
+    for wire_schema in ("full", "compact"):
+        cfg = Config(model=model, wire_schema=wire_schema, no_llm_cache=True)
+        engine = Txt2Yaml(cfg)
+        prompt = engine.get_initial_prompt(text)
+        structured_llm = engine.get_structured_llm(engine.quiz_schema)
+        start = time.perf_counter()
+        res = structured_llm.invoke(prompt)
+        elapsed = time.perf_counter() - start
+        usage = getattr(res['raw'], 'usage_metadata', None) or {}
+        parsed = engine.from_wire(res)['parsed']
+        num_items = len(parsed.questions.items) if parsed else 0
+        rows.append([wire_schema, num_items, usage.get('output_tokens', 0), f"{elapsed:.1f}"])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare the full and compact structured output schemas")
+    parser.add_argument('yaml_file', nargs='?', help="chapter yaml to measure, defaults to the prompt example")
+    parser.add_argument('--live', metavar='TXT_FILE', help="also time real requests for this chapter text")
+    parser.add_argument('--model', default='gpt-4o-2024-08-06')
+    args = parser.parse_args()
+
+    if args.yaml_file:
+        with open(args.yaml_file, 'r', encoding='utf-8') as file:
+            yaml_content = file.read()
+    else:
+        yaml_content = example_yaml
+    quiz = parse_yaml_raw_as(Quiz, yaml_content)
+
+    full_tokens, compact_tokens, lossless = measure_tokens(quiz, args.model)
+    table = PrettyTable()
+    table.field_names = ["Items", "Full tokens", "Compact tokens", "Saved", "Lossless"]
+    saved = 100 * (full_tokens - compact_tokens) / full_tokens if full_tokens else 0
+    table.add_row([len(quiz.questions.items), full_tokens, compact_tokens, f"{saved:.0f}%", lossless])
+    print(table)
+
+    if args.live:
+        table = PrettyTable()
+        table.field_names = ["Schema", "Items", "Output tokens", "Seconds"]
+        for row in measure_live(args.live, args.model):
+            table.add_row(row)
+        print(table)
+    return 0 if lossless else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
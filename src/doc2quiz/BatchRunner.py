@@ -0,0 +1,174 @@
+#
+# offline bulk question generation through a batch api
+#
+import os
+import json
+import time
+import logging
+
+import openai
+from pydantic import ValidationError
+
+from .Quiz import Quiz
+from .Providers import json_schema_format
+
+log = logging.getLogger()
+
+
+class OpenAIBatchService:
+    """
+    thin wrapper over the openai batch endpoint: upload a jsonl file, create a batch, poll, download
+    """
+    endpoint = "/v1/chat/completions"
+
+    def __init__(self):
+        self.client = openai.OpenAI()
+
+    def submit(self, batch_file):
+        with open(batch_file, 'rb') as file:
+            uploaded = self.client.files.create(file=file, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=self.endpoint,
+                                           completion_window="24h")
+        return batch.id
+
+    def status(self, batch_id):
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id, output_file):
+        batch = self.client.batches.retrieve(batch_id)
+        if not batch.output_file_id:
+            raise RuntimeError(f"batch {batch_id} finished with status {batch.status} and no output file")
+        content = self.client.files.content(batch.output_file_id)
+        with open(output_file, 'wb') as file:
+            file.write(content.read())
+
+
+class LocalBatchService:
+    """
+    File based stand in for the batch service, so the batch flow can run offline.
+    Every request body is answered with responder(body), which returns the message
+    content, and the output jsonl uses the same layout as the real service.
+    """
+    def __init__(self, responder):
+        self.responder = responder
+        self.batches = {}
+
+    def submit(self, batch_file):
+        batch_id = f"local_batch_{len(self.batches)}"
+        self.batches[batch_id] = batch_file
+        return batch_id
+
+    def status(self, batch_id):
+        return "completed" if batch_id in self.batches else "failed"
+
+    def download(self, batch_id, output_file):
+        with open(self.batches[batch_id], 'r', encoding='utf-8') as infile, \
+                open(output_file, 'w', encoding='utf-8') as outfile:
+            for line in infile:
+                request = json.loads(line)
+                content = self.responder(request["body"])
+                response = {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]},
+                    },
+                    "error": None,
+                }
+                outfile.write(json.dumps(response) + "\n")
+
+
+class BatchRunner:
+    """
+    Writes one chat request per chapter prompt to a jsonl batch file, submits it,
+    waits for the service and returns results shaped like with_structured_output(include_raw=True)
+    so they go through the same yaml path as interactive requests.
+    """
+    done_states = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(self, cfg, service, batch_dir, temperature=0, poll_seconds=30, schema=Quiz):
+        self.cfg = cfg
+        self.schema = schema
+        self.service = service
+        self.batch_dir = batch_dir
+        self.temperature = temperature
+        self.poll_seconds = poll_seconds
+
+    def build_request(self, custom_id, prompt):
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": OpenAIBatchService.endpoint,
+            "body": {
+                "model": self.cfg.model,
+                "temperature": self.temperature,
+                "messages": [{"role": "user", "content": prompt}],
+                "response_format": json_schema_format(self.schema),
+            },
+        }
+
+    def write_batch_file(self, prompts, batch_file):
+        with open(batch_file, 'w', encoding='utf-8') as file:
+            for custom_id, prompt in prompts.items():
+                file.write(json.dumps(self.build_request(custom_id, prompt)) + "\n")
+        log.info(f"wrote {len(prompts)} requests to {batch_file}")
+
+    def wait(self, batch_id):
+        while True:
+            status = self.service.status(batch_id)
+            if status in self.done_states:
+                return status
+            log.info(f"batch {batch_id} is {status}, checking again in {self.poll_seconds}s")
+            time.sleep(self.poll_seconds)
+
+    def parse_result(self, result):
+        if result.get("error"):
+            return {'raw': result, 'parsed': None, 'parsing_error': result["error"]}
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            return {'raw': result, 'parsed': None, 'parsing_error': f"status {response.get('status_code')}"}
+        message = response["body"]["choices"][0]["message"]
+        if message.get("refusal"):
+            return {'raw': result, 'parsed': None, 'parsing_error': message["refusal"]}
+        try:
+            parsed = self.schema.model_validate_json(message["content"])
+        except ValidationError as e:
+            return {'raw': result, 'parsed': None, 'parsing_error': e}
+        return {'raw': result, 'parsed': parsed, 'parsing_error': None}
+
+    def read_results(self, output_file):
+        results = {}
+        with open(output_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    result = json.loads(line)
+                    results[result["custom_id"]] = self.parse_result(result)
+        return results
+
+    def run(self, prompts):
+        """
+        prompts maps a custom id (the chapter) to its prompt, returns custom id -> result
+        """
+        if not prompts:
+            return {}
+        os.makedirs(self.batch_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        batch_file = os.path.join(self.batch_dir, f"batch-{stamp}.jsonl")
+        output_file = os.path.join(self.batch_dir, f"batch-{stamp}-output.jsonl")
+
+        self.write_batch_file(prompts, batch_file)
+        batch_id = self.service.submit(batch_file)
+        log.info(f"submitted batch {batch_id}")
+        status = self.wait(batch_id)
+        if status != "completed":
+            log.error(f"batch {batch_id} ended with status {status}")
+        try:
+            self.service.download(batch_id, output_file)
+        except RuntimeError as e:
+            log.error(f"Error: {e}")
+            return {}
+        results = self.read_results(output_file)
+        missing = set(prompts) - set(results)
+        if missing:
+            log.error(f"batch {batch_id} has no result for {sorted(missing)}")
+        return results
@@ -0,0 +1,83 @@
+#
+# small persistent key/value cache on sqlite
+#
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+log = logging.getLogger()
+
+
+class SqliteCache:
+    """
+    Key/value store in a single sqlite file with least-recently-used eviction
+    once the stored values grow past max_bytes. Keys are expected to be content
+    hashes, so entries never need to be updated in place.
+    """
+    def __init__(self, file_name, max_bytes=512 << 20):
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(file_name, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def has(self, key):
+        """
+        whether key is stored, without counting a hit or miss or touching its access time
+        """
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        log.debug(f"cache {self.file_name}: evicted {evicted} entries")
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -5,6 +5,8 @@ import argparse
 import logging
 from .Utils import Config
 from .Utils import Utils
+from .PdfExtractor import backends as pdf_backends
+from .Providers import providers, streaming_platforms, parse_target
 
 # steps
 from .Pdf2Txt import pdf_to_txt         # noqa: F401
@@ -19,9 +21,8 @@ class Doc2Quiz:
     def __init__(self):
         self.parser = argparse.ArgumentParser(description="Convert documents into quiz format.")
         self.stages = "pdf txt yaml xml quiz".split()  # Define valid stages
-        self.platforms = """ai21 anthropic aws cohere community databricks fireworks
-        google-genai google-vertexai groq huggingface mistralai nvidia-ai-endpoints ollama
-        openai together upstage""".split()
+        # every platform with a registered chat provider
+        self.platforms = sorted(providers)
         self.cfg = Config()
         self.setup_args()
 
@@ -39,6 +40,58 @@ class Doc2Quiz:
                                  help="chat model, eg gpt-4o-mini or claude-3-5-sonnet-20240620.")
         self.parser.add_argument('--no_feedback_images', action='store_true',
                                  help="do not generate images of pdf for feedback on quiz questions")
+        self.parser.add_argument('--force', action='store_true',
+                                 help="rebuild every chapter even if the manifest says it is up to date")
+        self.parser.add_argument('--pdf_backend', choices=list(pdf_backends), default='pypdf',
+                                 help="library used to extract text from pdf pages")
+        self.parser.add_argument('--jobs', type=int, default=1,
+                                 help="number of processes used to extract pdf pages")
+        self.parser.add_argument('--page_cache', action='store_true',
+                                 help="also keep extracted pdf page text on disk so later runs skip parsing")
+        self.parser.add_argument('--concurrency', type=int, default=1,
+                                 help="number of chapter requests sent to the chat api at once")
+        self.parser.add_argument('--rpm', type=int, default=0,
+                                 help="requests/minute limit of the chat api, 0 learns it from response headers")
+        self.parser.add_argument('--tpm', type=int, default=0,
+                                 help="tokens/minute limit of the chat api, 0 learns it from response headers")
+        self.parser.add_argument('--no_llm_cache', action='store_true',
+                                 help="always ask the chat api instead of reusing cached responses")
+        self.parser.add_argument('--llm_cache_mb', type=int, default=512,
+                                 help="size limit of the llm response cache, least recently used entries are evicted")
+        self.parser.add_argument('--llm_mode', choices=["interactive", "batch"], default="interactive",
+                                 help="batch submits all chapters as one batch api job, slower but cheaper")
+        self.parser.add_argument('--batch_poll_seconds', type=int, default=60,
+                                 help="how often to check on a submitted batch job")
+        self.parser.add_argument('--pack_tokens', type=int, default=0,
+                                 help="pack adjacent small sections into one request of up to this many tokens")
+        self.parser.add_argument('--max_section_tokens', type=int, default=0,
+                                 help="split larger sections into balanced requests, 0 (the default) never splits")
+        self.parser.add_argument('--wire_schema', choices=["full", "compact"], default="full",
+                                 help="compact asks the llm for short keys and type codes to cut output tokens")
+        self.parser.add_argument('--repair_attempts', type=int, default=1,
+                                 help="follow up requests for items that fail validation, 0 drops them")
+        self.parser.add_argument('--cascade_model', default="",
+                                 help="ask this cheaper model first and only escalate failed answers to --model")
+        self.parser.add_argument('--route', action='append', metavar='PLATFORM:MODEL',
+                                 help="send each request to the fastest of these targets with rate limit room, "
+                                      "repeat for every target")
+        self.parser.add_argument('--request_timeout', type=float, default=300,
+                                 help="give up on an llm request after this many seconds, 0 waits forever")
+        self.parser.add_argument('--hedge', action='store_true',
+                                 help="with --concurrency, send a duplicate of requests slower than the observed p95")
+        self.parser.add_argument('--hedge_budget', type=float, default=0.05,
+                                 help="at most this fraction of requests may be hedged")
+        self.parser.add_argument('--stream', action='store_true',
+                                 help="stream answers, validating and saving questions as they arrive "
+                                      "(openai compatible platforms only)")
+        self.parser.add_argument('--no_compact_text', action='store_true',
+                                 help="send chapter text as extracted, without joining hyphenated line breaks")
+        self.parser.add_argument('--match_backend', choices=["myers", "regex"], default="myers",
+                                 help="approximate matcher used to find quotes in the pdf text")
+        self.parser.add_argument('--no_quote_cache', action='store_true',
+                                 help="search every quote again instead of reusing locations from earlier runs")
+        self.parser.add_argument('--retry_failed', action='store_true',
+                                 help="only re-run the chapters the run journal records as failed")
         self.parser.add_argument('--num_words_per_question',
                                  default='200',
                                  help="determine th number of questions for a chapter based on this ratio")
@@ -86,11 +139,49 @@ class Doc2Quiz:
         self.cfg.platform = args.platform
         self.cfg.model = args.model
         self.cfg.no_feedback_images = args.no_feedback_images
+        self.cfg.page_cache = args.page_cache
+        self.cfg.jobs = max(1, args.jobs)
+        self.cfg.pdf_backend = args.pdf_backend
+        self.cfg.force = args.force
+        self.cfg.concurrency = max(1, args.concurrency)
+        self.cfg.rpm = args.rpm
+        self.cfg.tpm = args.tpm
+        self.cfg.no_llm_cache = args.no_llm_cache
+        self.cfg.llm_cache_mb = args.llm_cache_mb
+        self.cfg.llm_mode = args.llm_mode
+        self.cfg.batch_poll_seconds = args.batch_poll_seconds
+        self.cfg.pack_tokens = args.pack_tokens
+        self.cfg.max_section_tokens = args.max_section_tokens
+        self.cfg.wire_schema = args.wire_schema
+        self.cfg.repair_attempts = max(0, args.repair_attempts)
+        self.cfg.retry_failed = args.retry_failed
+        self.cfg.cascade_model = args.cascade_model
+        self.cfg.route = args.route or []
+        self.cfg.request_timeout = args.request_timeout
+        self.cfg.hedge = args.hedge
+        self.cfg.hedge_budget = args.hedge_budget
+        self.cfg.stream = args.stream
+        if args.stream:
+            self.check_stream(args)
+        self.cfg.no_compact_text = args.no_compact_text
+        self.cfg.match_backend = args.match_backend
+        self.cfg.no_quote_cache = args.no_quote_cache
         self.cfg.num_words_per_question = int(args.num_words_per_question)
 
         self.cfg.input_file_pdf = args.input_file_pdf
         self.cfg.input_file_csv = args.input_file_csv
 
+    def check_stream(self, args):
+        targets = [args.model] + (args.route or [])
+        if args.cascade_model:
+            targets.append(args.cascade_model)
+        platforms = {parse_target(target, args.platform)[0] for target in targets}
+        unsupported = sorted(platforms - streaming_platforms)
+        if unsupported:
+            self.parser.error(f"--stream needs an openai compatible platform, not {' '.join(unsupported)}")
+        if args.hedge:
+            self.parser.error("--stream and --hedge can't be combined, streamed answers are never hedged")
+
     def run(self):
         # Parse the arguments
         args = self.parser.parse_args()
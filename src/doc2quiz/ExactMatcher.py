@@ -0,0 +1,66 @@
+#
+# aho-corasick automaton to find many quotes verbatim in one scan of a passage
+#
+import logging
+from collections import deque
+
+log = logging.getLogger()
+
+
+class ExactMatcher:
+    """
+    Trie of all the patterns with failure links (Aho-Corasick), so a single scan
+    of the text finds every occurrence of every pattern. Used as the first tier of
+    quote search: most quotes are verbatim and never need the fuzzy matchers.
+    """
+    def __init__(self, patterns):
+        self.lengths = [len(pattern) for pattern in patterns]
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = child
+            self.out[node].append(index)
+        self.num_patterns = sum(1 for length in self.lengths if length)
+
+        # breadth first, so the failure target of a node is always done before it
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def first_matches(self, text):
+        """
+        {pattern index: start of its first occurrence in text}, patterns not in text are left out
+        """
+        found = {}
+        if not self.num_patterns:
+            return found
+        node = 0
+        for pos, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for index in self.out[node]:
+                if index not in found:
+                    found[index] = pos + 1 - self.lengths[index]
+                    if len(found) == self.num_patterns:
+                        return found
+        return found
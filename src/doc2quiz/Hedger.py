@@ -0,0 +1,80 @@
+#
+# deadlines and hedged duplicates for async llm requests
+#
+import time
+import asyncio
+import logging
+
+log = logging.getLogger()
+
+
+class Hedger:
+    """
+    Bounds every async request by a deadline and, when enabled, fires a duplicate
+    once the request has been running longer than its target's recent p95 latency.
+    Whichever answers first wins and the other one is cancelled. Hedges only go
+    out while they stay under budget (a fraction of all requests) and the rate
+    limiter has room for them, so the extra spend is bounded.
+    """
+    min_samples = 20
+
+    def __init__(self, deadline=None, enabled=False, budget=0.05):
+        self.deadline = deadline or None
+        self.enabled = enabled
+        self.budget = budget
+        self.requests = 0
+        self.issued = 0
+        self.won = 0
+        self.timeouts = 0
+
+    def hedge_delay(self, histogram):
+        if not self.enabled or len(histogram.recent) < self.min_samples:
+            return None
+        delay = histogram.percentile(95)
+        if self.deadline is not None and delay >= self.deadline:
+            return None
+        return delay
+
+    def may_hedge(self, rate_limiter, num_tokens):
+        if self.issued + 1 > self.budget * self.requests:
+            return False
+        return rate_limiter.reserve(num_tokens) <= 0
+
+    async def call(self, make_call, histogram, rate_limiter, num_tokens):
+        """
+        await make_call(), hedged and bounded by the deadline. raises TimeoutError when
+        nothing answered in time, or the last error when every attempt failed.
+        """
+        self.requests += 1
+        start = time.perf_counter()
+        tasks = [asyncio.ensure_future(make_call())]
+        hedge = None
+        try:
+            delay = self.hedge_delay(histogram)
+            if delay is not None:
+                done, pending = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.may_hedge(rate_limiter, num_tokens):
+                    log.debug(f"request still running after p95 {delay:.1f}s, sending a hedge")
+                    self.issued += 1
+                    hedge = asyncio.ensure_future(make_call())
+                    tasks.append(hedge)
+            error = None
+            while tasks:
+                timeout = None
+                if self.deadline is not None:
+                    timeout = max(0.0, self.deadline - (time.perf_counter() - start))
+                done, pending = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.timeouts += 1
+                    raise TimeoutError(f"no answer within the {self.deadline}s request deadline")
+                for task in done:
+                    tasks.remove(task)
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.won += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
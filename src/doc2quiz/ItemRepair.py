@@ -0,0 +1,137 @@
+#
+# keep the valid items of a rejected llm answer and ask again only for the broken ones
+#
+import json
+import logging
+
+from pydantic import ValidationError
+
+from .Quiz import Item, Quiz, Questions
+from .QuizWire import WItem, expand_item
+
+log = logging.getLogger()
+
+
+class ItemRepair:
+    """
+    A single bad item (say a multiple_choice with two correct options) fails
+    validation of the whole Quiz. Instead of dropping the chapter, the raw answer
+    is validated item by item: good items are kept and the failed ones are sent
+    back with their validator message in a much smaller repair request.
+    """
+    def __init__(self, compact=False):
+        self.compact = compact
+
+    def raw_answer(self, res):
+        """
+        the unvalidated json the llm returned, from a tool call, the message content or a batch result
+        """
+        raw = res.get('raw')
+        if isinstance(raw, dict):
+            try:
+                content = raw["response"]["body"]["choices"][0]["message"]["content"]
+            except (KeyError, IndexError, TypeError):
+                return None
+        else:
+            tool_calls = getattr(raw, 'tool_calls', None)
+            invalid_tool_calls = getattr(raw, 'invalid_tool_calls', None)
+            if tool_calls:
+                content = tool_calls[0].get('args')
+            elif invalid_tool_calls:
+                content = invalid_tool_calls[0].get('args')
+            else:
+                content = getattr(raw, 'content', None)
+        if isinstance(content, str):
+            try:
+                content = json.loads(content)
+            except ValueError:
+                return None
+        return content if isinstance(content, dict) else None
+
+    def answer_items(self, answer):
+        if not isinstance(answer, dict):
+            return None
+        if self.compact:
+            items = answer.get('i')
+        else:
+            items = (answer.get('questions') or {}).get('items')
+        return items if isinstance(items, list) else None
+
+    def res_items(self, res):
+        """
+        raw item dicts of an answer, whether or not it passed validation
+        """
+        if res['parsing_error'] is None and res['parsed'] is not None:
+            return self.answer_items(res['parsed'].model_dump(mode="json", exclude_none=True))
+        return self.answer_items(self.raw_answer(res))
+
+    def validate_item(self, raw_item):
+        """
+        returns (Item, None) or (None, validator message)
+        """
+        try:
+            if self.compact:
+                raw_item = expand_item(WItem.model_validate(raw_item))
+            return Item.model_validate(raw_item), None
+        except ValidationError as e:
+            return None, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+        except (ValueError, KeyError, TypeError) as e:
+            return None, str(e)
+
+    def salvage(self, res):
+        """
+        split a rejected answer into slots (an Item, or None where validation failed) and
+        the failed (slot, raw item, message) list. slots is None when nothing can be salvaged.
+        """
+        raw_items = self.res_items(res)
+        if not raw_items:
+            return None, []
+        slots = []
+        failed = []
+        for raw_item in raw_items:
+            item, error = self.validate_item(raw_item)
+            if item is None:
+                failed.append((len(slots), raw_item, error))
+            slots.append(item)
+        return slots, failed
+
+    def get_repair_prompt(self, prompt_prefix, text, failed):
+        rejected = ""
+        for num, (slot, raw_item, error) in enumerate(failed, 1):
+            rejected += f"""
+question {num}: {json.dumps(raw_item)}
+problem: {error}
+"""
+        return prompt_prefix + f"""
+The {len(failed)} questions below about the passage were rejected by the validator.
+Fix the listed problem in each one and return exactly {len(failed)} corrected questions, in the same order.
+{rejected}
+the passage starts here ->
+
+{text}
+
+<- end of passage.
+"""
+
+    def apply_repair(self, slots, failed, res):
+        """
+        fill the failed slots from a repair answer, returns the items that are still failing
+        """
+        raw_items = self.res_items(res) or []
+        still_failed = []
+        for num, (slot, raw_item, error) in enumerate(failed):
+            if num >= len(raw_items):
+                still_failed.append((slot, raw_item, error))
+                continue
+            item, error = self.validate_item(raw_items[num])
+            if item is None:
+                still_failed.append((slot, raw_items[num], error))
+            else:
+                slots[slot] = item
+        return still_failed
+
+    def merged_res(self, res, slots):
+        items = [item for item in slots if item is not None]
+        if not items:
+            return res
+        return {'raw': res['raw'], 'parsed': Quiz(questions=Questions(items=items)), 'parsing_error': None}
@@ -0,0 +1,122 @@
+#
+# incremental parsing and validation of a streamed structured answer
+#
+import json
+import time
+import logging
+
+log = logging.getLogger()
+
+
+class StreamAborted(Exception):
+    pass
+
+
+class ItemStream:
+    """
+    Tracks just enough json structure (strings, nesting and object keys) to cut
+    each element of the items array out of a streamed answer as soon as its closing
+    brace arrives. Every item is validated on the spot and the good ones are passed
+    to on_item. feed() raises StreamAborted once the answer is clearly malformed or
+    off-schema, so the caller can stop paying for the rest of it.
+    """
+    max_preamble = 4000
+    max_invalid = 3
+
+    def __init__(self, repair, items_key="items", on_item=None):
+        self.repair = repair
+        self.items_key = items_key
+        self.on_item = on_item
+        self.chunks = []
+        self.length = 0
+        self.stack = []
+        self.root_closed = False
+        self.in_string = False
+        self.escape = False
+        self.string_chars = []
+        self.last_string = None
+        self.last_key = None
+        self.items_depth = None
+        self.item_chars = None
+        self.valid = []
+        self.invalid = []
+        self.started = time.perf_counter()
+        self.first_item_seconds = None
+        self.error = None
+
+    def text(self):
+        return "".join(self.chunks)
+
+    def feed(self, text):
+        if not isinstance(text, str) or not text:
+            return
+        self.chunks.append(text)
+        for char in text:
+            self.feed_char(char)
+        self.length += len(text)
+        if self.items_depth is None and self.length > self.max_preamble:
+            self.abort(f"no {self.items_key} array in the first {self.max_preamble} characters")
+
+    def abort(self, reason):
+        self.error = StreamAborted(reason)
+        raise self.error
+
+    def feed_char(self, char):
+        if self.item_chars is not None:
+            self.item_chars.append(char)
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif char == '\\':
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                self.last_string = "".join(self.string_chars)
+            elif len(self.string_chars) < 64:
+                # only keys are needed, and they are short
+                self.string_chars.append(char)
+            return
+        if char.isspace():
+            return
+        if not self.stack:
+            if self.root_closed:
+                return
+            if char != '{':
+                self.abort(f"answer starts with {char!r} instead of a json object")
+        if char == '"':
+            self.in_string = True
+            self.string_chars = []
+        elif char == ':':
+            self.last_key = self.last_string
+        elif char in '{[':
+            if char == '{' and self.items_depth is not None and len(self.stack) == self.items_depth:
+                self.item_chars = ['{']
+            self.stack.append(char)
+            if char == '[' and self.items_depth is None and self.last_key == self.items_key:
+                self.items_depth = len(self.stack)
+        elif char in '}]':
+            if not self.stack or self.stack[-1] != {'}': '{', ']': '['}[char]:
+                self.abort(f"unbalanced {char!r} in answer")
+            self.stack.pop()
+            self.root_closed = not self.stack
+            if char == '}' and self.item_chars is not None and len(self.stack) == self.items_depth:
+                self.finish_item("".join(self.item_chars))
+                self.item_chars = None
+
+    def finish_item(self, item_text):
+        try:
+            raw_item = json.loads(item_text)
+        except ValueError as e:
+            self.abort(f"malformed item json: {e}")
+        item, error = self.repair.validate_item(raw_item)
+        if item is None:
+            self.invalid.append((raw_item, error))
+            log.debug(f"streamed item {len(self.valid) + len(self.invalid)} is invalid: {error}")
+            if len(self.invalid) >= self.max_invalid and len(self.invalid) > len(self.valid):
+                self.abort(f"{len(self.invalid)} of {len(self.valid) + len(self.invalid)} items are off-schema")
+            return
+        if self.first_item_seconds is None:
+            self.first_item_seconds = time.perf_counter() - self.started
+        self.valid.append(item)
+        if self.on_item is not None:
+            self.on_item(item)
@@ -0,0 +1,99 @@
+#
+# per chapter run journal so long runs can be resumed after a crash
+#
+import os
+import json
+import time
+import logging
+from collections import Counter
+
+from .Utils import Utils
+
+log = logging.getLogger()
+
+
+class Journal:
+    """
+    Tracks every chapter of a stage through pending -> in-flight -> done/failed,
+    with attempt count, elapsed time and tokens, eg:
+
+        {"txt_to_yaml": {"ch7p2": {"status": "done", "inputs": "5e1f...", "attempts": 1,
+                                   "elapsed": 41.2, "tokens": 9120, "error": null}}}
+
+    The file is rewritten on every status change, so a killed run leaves chapters
+    it was working on as in-flight and the next run picks them up again. Failed
+    chapters are left alone until the run is started with retry_failed.
+    """
+    statuses = ("pending", "in-flight", "done", "failed")
+
+    def __init__(self, cfg, stage):
+        self.cfg = cfg
+        self.stage = stage
+        self.file_name = cfg.journal_file
+        self.data = self.load()
+        self.started = {}
+        interrupted = [chapter for chapter, entry in self.entries().items() if entry["status"] == "in-flight"]
+        if interrupted:
+            log.info(f"{stage}: resuming {len(interrupted)} chapters interrupted in the last run")
+
+    def load(self):
+        if not os.path.isfile(self.file_name):
+            return {}
+        try:
+            with open(self.file_name, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            log.warning(f"ignoring unreadable journal {self.file_name}: {e}")
+            return {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.file_name) or ".", exist_ok=True)
+        Utils.write_file_atomic(self.file_name, json.dumps(self.data, indent=2, sort_keys=True))
+
+    def entries(self):
+        return self.data.setdefault(self.stage, {})
+
+    def entry(self, chapter):
+        return self.entries().setdefault(chapter, {"status": "pending", "inputs": None, "attempts": 0,
+                                                   "elapsed": 0.0, "tokens": 0, "error": None})
+
+    def should_skip(self, chapter, inputs_digest):
+        """
+        failed chapters are only retried with retry_failed, or once their inputs change.
+        with retry_failed everything but the failed chapters is skipped.
+        """
+        entry = self.entries().get(chapter)
+        failed = entry is not None and entry["status"] == "failed"
+        if self.cfg.retry_failed:
+            return not failed
+        if self.cfg.force or not failed or entry["inputs"] != inputs_digest:
+            return False
+        log.info(f"{self.stage}: {chapter} failed last time ({entry['error']}), use --retry_failed to re-queue")
+        return True
+
+    def queue(self, chapter, inputs_digest):
+        entry = self.entry(chapter)
+        entry.update(status="pending", inputs=inputs_digest, error=None)
+        self.save()
+
+    def start(self, chapter):
+        entry = self.entry(chapter)
+        entry["status"] = "in-flight"
+        entry["attempts"] += 1
+        self.started[chapter] = time.perf_counter()
+        self.save()
+
+    def add_tokens(self, chapter, tokens):
+        self.entry(chapter)["tokens"] += tokens
+
+    def finish(self, chapter, error=None):
+        entry = self.entry(chapter)
+        entry["status"] = "failed" if error else "done"
+        entry["error"] = str(error) if error else None
+        if chapter in self.started:
+            entry["elapsed"] += time.perf_counter() - self.started.pop(chapter)
+        self.save()
+
+    def counts(self):
+        counts = Counter(entry["status"] for entry in self.entries().values())
+        return {status: counts[status] for status in self.statuses}
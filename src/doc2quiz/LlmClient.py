@@ -0,0 +1,62 @@
+#
+# long lived chat client shared by every chapter of a run
+#
+import time
+import logging
+
+import httpx
+
+from .Providers import get_chat_model, json_schema_format
+
+try:
+    import h2  # noqa: F401
+    http2 = True
+except ImportError:
+    http2 = False
+
+log = logging.getLogger()
+
+
+class LlmClient:
+    """
+    Builds the chat model, its http connection pools and the structured output
+    wrappers once per run and provider. Chapters (and async workers) share them,
+    so tcp/tls connections stay alive between requests and the pydantic schema is
+    only converted once.
+    """
+    def __init__(self, cfg, temperature=0, timeout=600, model=None, platform=None):
+        start = time.perf_counter()
+        self.cfg = cfg
+        self.platform = platform or cfg.platform
+        pool_size = max(cfg.concurrency, 10)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                              keepalive_expiry=120)
+        self.http_client = httpx.Client(http2=http2, limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+        self.model = get_chat_model(self.platform, model or cfg.model, temperature,
+                                    self.http_client, self.http_async_client, timeout)
+        self.structured = {}
+        self.streaming = {}
+        self.setup_seconds = time.perf_counter() - start
+        log.debug(f"{self.platform} chat client ready in {self.setup_seconds:.3f}s, http2={http2}")
+
+    def structured_llm(self, schema):
+        if schema not in self.structured:
+            start = time.perf_counter()
+            self.structured[schema] = self.model.with_structured_output(schema, include_raw=True)
+            self.setup_seconds += time.perf_counter() - start
+        return self.structured[schema]
+
+    def streaming_llm(self, schema):
+        """
+        chat model asked for raw json of schema, for streaming the answer text
+        """
+        if schema not in self.streaming:
+            self.streaming[schema] = self.model.bind(response_format=json_schema_format(schema), stream_usage=True)
+        return self.streaming[schema]
+
+    def close(self):
+        self.http_client.close()
+
+    async def aclose(self):
+        await self.http_async_client.aclose()
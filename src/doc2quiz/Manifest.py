@@ -0,0 +1,86 @@
+#
+# build manifest so each stage can skip chapters whose inputs didn't change
+#
+import os
+import json
+import hashlib
+import logging
+
+from . import __version__
+
+log = logging.getLogger()
+
+
+class Manifest:
+    """
+    Records a digest of the inputs used to build each chapter in each stage, eg:
+
+        {"txt_to_yaml": {"ch7p2": {"inputs": "5e1f...", "version": "0.0.3"}}}
+
+    A chapter is fresh when its input digest and the doc2quiz version match the
+    recorded entry and all of its outputs still exist.
+    """
+    def __init__(self, cfg, stage):
+        self.cfg = cfg
+        self.stage = stage
+        self.file_name = cfg.manifest_file
+        self.data = self.load()
+        self.skipped = 0
+
+    def load(self):
+        if not os.path.isfile(self.file_name):
+            return {}
+        try:
+            with open(self.file_name, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            log.warning(f"ignoring unreadable manifest {self.file_name}: {e}")
+            return {}
+
+    def save(self):
+        # another stage may have recorded chapters since we loaded, only replace our own section
+        data = self.load()
+        data[self.stage] = self.data.get(self.stage, {})
+        self.data = data
+        os.makedirs(os.path.dirname(self.file_name) or ".", exist_ok=True)
+        tmp_file_name = f"{self.file_name}.tmp"
+        with open(tmp_file_name, 'w', encoding='utf-8') as file:
+            json.dump(self.data, file, indent=2, sort_keys=True)
+        os.replace(tmp_file_name, self.file_name)
+
+    @staticmethod
+    def digest(*parts):
+        """
+        sha256 of a mix of str, bytes and json-able values
+        """
+        sha = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, bytes):
+                sha.update(part)
+            elif isinstance(part, str):
+                sha.update(part.encode('utf-8'))
+            else:
+                sha.update(json.dumps(part, sort_keys=True).encode('utf-8'))
+            sha.update(b'\0')
+        return sha.hexdigest()
+
+    def is_fresh(self, chapter, inputs, outputs=()):
+        if self.cfg.force:
+            return False
+        entry = self.data.get(self.stage, {}).get(chapter)
+        if not entry:
+            return False
+        if entry.get("inputs") != self.digest(inputs) or entry.get("version") != __version__:
+            return False
+        if not all(os.path.exists(output) for output in outputs):
+            return False
+        self.skipped += 1
+        log.info(f"{self.stage}: {chapter} is up to date, skipping")
+        return True
+
+    def record(self, chapter, inputs):
+        self.data.setdefault(self.stage, {})[chapter] = {
+            "inputs": self.digest(inputs),
+            "version": __version__,
+        }
+        self.save()
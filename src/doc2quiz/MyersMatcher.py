@@ -0,0 +1,92 @@
+#
+# bit-parallel approximate substring matching (Myers 1999, in Hyyro's formulation)
+#
+import logging
+
+log = logging.getLogger()
+
+
+def lowercase(text):
+    """
+    lowercase that keeps offsets, a few chars (İ) grow when lowercased and are left as is
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(char if len(char.lower()) != 1 else char.lower() for char in text)
+
+
+class MyersMatcher:
+    """
+    Finds the substring of a text with the fewest edits (insert, delete, substitute)
+    to a pattern. One column of the edit distance table is kept as bit vectors of
+    vertical deltas, so each text char costs a handful of int operations however long
+    the pattern is (python ints are arbitrary width). A forward scan finds the best
+    end and its edit count, a scan of the reversed text anchored there finds the start.
+    """
+    def __init__(self, ignore_case=True):
+        self.ignore_case = ignore_case
+
+    def peq(self, pattern):
+        masks = {}
+        for i, char in enumerate(pattern):
+            masks[char] = masks.get(char, 0) | (1 << i)
+        return masks
+
+    def scores(self, pattern, text, anchored=False):
+        """
+        yields, after each char of text, the fewest edits between pattern and a substring
+        ending there. anchored only allows substrings that start at the first char
+        """
+        m = len(pattern)
+        peq = self.peq(pattern)
+        mask = (1 << m) - 1
+        high = 1 << (m - 1)
+        carry = 1 if anchored else 0
+        pv = mask
+        mv = 0
+        score = m
+        for char in text:
+            eq = peq.get(char, 0)
+            xv = eq | mv
+            xh = ((((eq & pv) + pv) & mask) ^ pv) | eq
+            ph = mv | (~(xh | pv) & mask)
+            mh = pv & xh
+            if ph & high:
+                score += 1
+            elif mh & high:
+                score -= 1
+            ph = ((ph << 1) | carry) & mask
+            mh = (mh << 1) & mask
+            pv = mh | (~(xv | ph) & mask)
+            mv = ph & xv
+            yield score
+
+    def search(self, text, pattern, max_edits=None):
+        """
+        (start, end, edits) of the best match of pattern in text, the leftmost end on ties.
+        None when it takes more than max_edits
+        """
+        if not pattern:
+            return 0, 0, 0
+        if self.ignore_case:
+            text, pattern = lowercase(text), lowercase(pattern)
+        best_edits = len(pattern)
+        best_end = 0
+        for end, score in enumerate(self.scores(pattern, text), 1):
+            if score < best_edits:
+                best_edits, best_end = score, end
+                if score == 0:
+                    break
+        if max_edits is not None and best_edits > max_edits:
+            return None
+        # every match ending at best_end starts at most len(pattern) + edits chars earlier
+        lowest = max(0, best_end - len(pattern) - best_edits)
+        reverse = text[lowest:best_end][::-1]
+        length = 0
+        if best_edits < len(pattern):
+            for chars, score in enumerate(self.scores(pattern[::-1], reverse, anchored=True), 1):
+                if score == best_edits:
+                    length = chars
+                    break
+        return best_end - length, best_end, best_edits
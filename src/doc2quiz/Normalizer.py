@@ -0,0 +1,108 @@
+#
+# linear time removal of pdf extraction artifacts, with a map back to the original offsets
+#
+import logging
+from array import array
+
+import regex
+import wordninja
+
+log = logging.getLogger()
+
+
+class NormalizedText:
+    """
+    normalized text plus, for every character, its offset in the original text
+    """
+    def __init__(self, original, text, offsets):
+        self.original = original
+        self.text = text
+        # one entry per normalized char and a final len(original), so spans ending at len(text) map too
+        self.offsets = offsets
+
+    def span(self, beg, end):
+        """
+        original (beg, end) of text[beg:end]. removed artifacts inside the span are part of it
+        """
+        if end <= beg:
+            return self.offsets[beg], self.offsets[beg]
+        return self.offsets[beg], self.offsets[end - 1] + 1
+
+
+class Normalizer:
+    """
+    Undoes pdf extraction artifacts in one scan: ' -\\n' and '-\\n' line breaks inside
+    words are dropped, the remaining newlines become spaces and whitespace runs collapse
+    to a single space that maps to the first char of the run (or, with keep_paragraphs,
+    to a paragraph break when the run spans a blank line). Optionally, joined
+    words (spaceflightlaunch) are split with wordninja in a second linear scan.
+    Every normalized char remembers its original offset in an int array, so a match
+    maps back to the original text with two lookups.
+    """
+    # alternation is tried left to right, so a hyphenated line break wins over the whitespace
+    # around it. single spaces are already normalized and aren't matched at all
+    artifacts = regex.compile(r'(?P<hyphen> ?-\n)|\s{2,}|[^\S ]')
+    words = regex.compile(r'[^\W\d_]+')
+
+    def __init__(self, split_joined_words=False, keep_paragraphs=False):
+        self.split_joined_words = split_joined_words
+        self.keep_paragraphs = keep_paragraphs
+        self.word_splits = {}
+
+    def normalize(self, text):
+        parts = []
+        offsets = array('i')
+        pos = 0
+        for match in self.artifacts.finditer(text):
+            beg, end = match.span()
+            parts.append(text[pos:beg])
+            offsets.extend(range(pos, beg))
+            replacement = self.replacement(match)
+            parts.append(replacement)
+            offsets.extend([beg] * len(replacement))
+            pos = end
+        parts.append(text[pos:])
+        offsets.extend(range(pos, len(text)))
+        normalized = "".join(parts)
+        if self.split_joined_words:
+            normalized, offsets = self.split_words(normalized, offsets)
+        offsets.append(len(text))
+        return NormalizedText(text, normalized, offsets)
+
+    def replacement(self, match):
+        if match.group('hyphen'):
+            return ''
+        if self.keep_paragraphs and match.group().count('\n') > 1:
+            return '\n\n'
+        return ' '
+
+    def split_word(self, word):
+        if word not in self.word_splits:
+            pieces = wordninja.split(word)
+            # wordninja drops chars it can't place, only keep splits that are pure space insertions
+            self.word_splits[word] = pieces if "".join(pieces) == word else [word]
+        return self.word_splits[word]
+
+    def split_words(self, text, offsets):
+        parts = []
+        split_offsets = array('i')
+        pos = 0
+        for match in self.words.finditer(text):
+            pieces = self.split_word(match.group())
+            if len(pieces) < 2:
+                continue
+            beg, end = match.span()
+            parts.append(text[pos:beg])
+            split_offsets.extend(offsets[pos:beg])
+            for n, piece in enumerate(pieces):
+                if n:
+                    # an inserted space maps to the char after it
+                    parts.append(' ')
+                    split_offsets.append(offsets[beg])
+                parts.append(piece)
+                split_offsets.extend(offsets[beg:beg + len(piece)])
+                beg += len(piece)
+            pos = end
+        parts.append(text[pos:])
+        split_offsets.extend(offsets[pos:len(text)])
+        return "".join(parts), split_offsets
@@ -0,0 +1,71 @@
+#
+# page level text cache for pdf extraction
+#
+import os
+import logging
+
+from .Utils import Utils
+
+log = logging.getLogger()
+
+
+class PageCache:
+    """
+    Keeps the extracted text of each pdf page so overlapping toc ranges
+    (eg a chapter row 13-18 and its section rows 13-13, 14-14 ...) only parse
+    every page once. Pages live in memory for the run, and optionally on disk
+    under <cache_dir>/<pdf hash>-<backend>/<page>.txt so later runs can skip parsing too.
+    """
+    def __init__(self, pdf_file, cache_dir=None, backend="pypdf"):
+        self.pdf_hash = Utils.hash_file(pdf_file)
+        self.cache_dir = None
+        if cache_dir:
+            self.cache_dir = os.path.join(cache_dir, "pages", f"{self.pdf_hash[:16]}-{backend}")
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.pages = {}
+        self.hits = 0
+        self.misses = 0
+
+    def page_file_name(self, page_num):
+        return os.path.join(self.cache_dir, f"{page_num:05d}.txt")
+
+    def get(self, page_num):
+        """
+        return cached text for page_num, or None if it hasn't been extracted yet
+        """
+        if page_num in self.pages:
+            return self.pages[page_num]
+        if self.cache_dir:
+            file_name = self.page_file_name(page_num)
+            if os.path.isfile(file_name):
+                with open(file_name, 'r', encoding='utf-8', newline='') as file:
+                    text = file.read()
+                self.pages[page_num] = text
+                return text
+        return None
+
+    def put(self, page_num, text):
+        self.pages[page_num] = text
+        if self.cache_dir:
+            file_name = self.page_file_name(page_num)
+            tmp_file_name = f"{file_name}.tmp"
+            with open(tmp_file_name, 'w', encoding='utf-8', newline='') as file:
+                file.write(text)
+            os.replace(tmp_file_name, file_name)
+
+    def get_text(self, page_num, extract_fn):
+        """
+        cached text of page_num, calling extract_fn(page_num) only on a miss
+        """
+        text = self.get(page_num)
+        if text is None:
+            self.misses += 1
+            text = extract_fn(page_num)
+            self.put(page_num, text)
+        else:
+            self.hits += 1
+        return text
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        log.info(f"page cache: {self.misses} pages extracted, {self.hits} reused out of {total} page reads")
@@ -0,0 +1,58 @@
+#
+# tf-idf index over overlapping windows of one passage, queried for many quotes at once
+#
+import logging
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+log = logging.getLogger()
+
+
+class PassageIndex:
+    """
+    Chunks a passage into overlapping windows and fits tf-idf on them once. top_windows
+    then scores every quote against every window with a single sparse matrix product
+    (rows are l2 normalized, so the product is the cosine similarity) and returns the
+    best k windows of each quote as (start, end, similarity 0-100) in passage offsets.
+    """
+    min_chunk_size = 200
+
+    def __init__(self, passage, max_quote_chars=0):
+        self.passage = passage
+        # a window is 1.5x the longest quote and half of it overlaps the next one, so every
+        # quote fits entirely inside some window
+        self.chunk_size = int(max(1.5 * max_quote_chars, self.min_chunk_size))
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_size // 2,
+            length_function=len,
+            is_separator_regex=False,
+            add_start_index=True,
+        )
+        docs = text_splitter.create_documents([passage])
+        self.windows = [doc.page_content for doc in docs]
+        self.starts = [doc.metadata["start_index"] for doc in docs]
+        log.debug(f"indexed {len(self.windows)} windows of up to {self.chunk_size} chars")
+        self.vectorizer = TfidfVectorizer()
+        try:
+            self.matrix = self.vectorizer.fit_transform(self.windows)
+        except ValueError:
+            # no words at all in the passage
+            self.matrix = None
+
+    def top_windows(self, quotes, k=3):
+        """
+        for each quote a list of up to k (start, end, similarity), best first
+        """
+        if self.matrix is None or not quotes:
+            return [[] for quote in quotes]
+        scores = (self.vectorizer.transform(quotes) @ self.matrix.T).toarray() * 100
+        k = min(k, scores.shape[1])
+        best = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        results = []
+        for row, columns in enumerate(best):
+            results.append([(self.starts[col], self.starts[col] + len(self.windows[col]), float(scores[row, col]))
+                            for col in columns])
+        return results
@@ -3,10 +3,13 @@
 #
 import sys
 import logger
-from pypdf import PdfReader
+from concurrent.futures import ProcessPoolExecutor
 from prettytable import PrettyTable
 
 from .Utils import Utils
+from .PageCache import PageCache
+from .PdfExtractor import get_extractor
+from .Manifest import Manifest
 
 log = logger.getLogger()
 
@@ -20,6 +23,14 @@ class PdfExtractionError(Exception):
     pass
 
 
+def extract_pages_worker(backend, pdf_file, page_nums):
+    """
+    runs in a pool process: open a private reader and extract a shard of pages
+    """
+    with get_extractor(backend, pdf_file) as extractor:
+        return [(page_num, extractor.extract_page(page_num)) for page_num in page_nums]
+
+
 class Pdf2Txt:
     def __init__(self, cfg):
         self.cfg = cfg
@@ -43,20 +54,69 @@ class Pdf2Txt:
         log.info(f" number of words per question is {self.cfg.num_words_per_question}")
         log.info(table)
 
+    def prefetch_pages(self, page_cache, lines):
+        """
+        extract the distinct uncached pages of the toc on a process pool and fill page_cache.
+        chapters are still assembled serially in toc order, so output matches a serial run.
+        """
+        pages = set()
+        for start_page, end_page, chapter, title in lines:
+            pages.update(range(start_page, end_page + 1))
+        pages = sorted(page_num for page_num in pages if page_cache.get(page_num) is None)
+        if not pages:
+            return
+
+        # a few shards per worker keeps the pool busy when some pages are much slower than others
+        jobs = self.cfg.jobs
+        num_shards = min(len(pages), jobs * 4)
+        shard_size = -(-len(pages) // num_shards)
+        shards = [pages[i:i + shard_size] for i in range(0, len(pages), shard_size)]
+        log.info(f"extracting {len(pages)} pages with {jobs} processes in {len(shards)} shards")
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(extract_pages_worker, self.cfg.pdf_backend, self.cfg.input_file_pdf, shard)
+                       for shard in shards]
+            for future in futures:
+                for page_num, text in future.result():
+                    page_cache.put(page_num, text)
+                    page_cache.misses += 1
+
     def extract_chapter_text_from_pdf(self):
         res = []
         try:
             # Open the PDF file
-            with open(self.cfg.input_file_pdf, 'rb') as pdf_file:
-                pdf_reader = PdfReader(pdf_file)
-                
+            with get_extractor(self.cfg.pdf_backend, self.cfg.input_file_pdf) as extractor:
+                cache_dir = self.cfg.output_dir_cache if self.cfg.page_cache else None
+                page_cache = PageCache(self.cfg.input_file_pdf, cache_dir, backend=self.cfg.pdf_backend)
+
+                manifest = Manifest(self.cfg, "pdf_to_txt")
+
+                def chapter_inputs(start_page, end_page, title):
+                    return {"pdf": page_cache.pdf_hash, "pages": [start_page, end_page],
+                            "title": title, "backend": self.cfg.pdf_backend}
+
                 lines = Utils.read_toc_csv(self.cfg.input_file_csv)
-                for start_page, end_page, chapter, title in lines:
-                    # Extract text from the specified page range
+                res = [None] * len(lines)
+                stale_lines = []
+                for i, (start_page, end_page, chapter, title) in enumerate(lines):
+                    file_name = f'{self.cfg.output_dir_txt}/{chapter}.txt'
+                    if manifest.is_fresh(chapter, chapter_inputs(start_page, end_page, title), [file_name]):
+                        # keep the summary table complete for unchanged chapters
+                        with open(file_name, 'r', encoding='utf-8') as text_file:
+                            text_file.readline()
+                            num_words = len(text_file.read().split())
+                        num_questions = round(num_words / self.cfg.num_words_per_question)
+                        res[i] = [chapter, end_page - start_page + 1, num_questions, title]
+                    else:
+                        stale_lines.append((i, lines[i]))
+
+                if self.cfg.jobs > 1:
+                    self.prefetch_pages(page_cache, [line for i, line in stale_lines])
+                for i, (start_page, end_page, chapter, title) in stale_lines:
+                    # Assemble the page range from the cache, each page is only parsed once
                     extracted_text = ''
                     for page_num in range(start_page, end_page + 1):
-                        page = pdf_reader.get_page(page_num)
-                        extracted_text += page.extract_text()
+                        extracted_text += page_cache.get_text(page_num, extractor.extract_page)
 
                     # Save the extracted text to a file
                     file_name = f'{self.cfg.output_dir_txt}/{chapter}.txt'
@@ -64,10 +124,13 @@ class Pdf2Txt:
                         text_file.write(f"{chapter} - {title} (pages {start_page + 1} to {end_page + 1})\n")
                         text_file.write(extracted_text)
                     log.info(f'Saved from p{start_page + 1} to p{end_page + 1} to {file_name}')
+                    manifest.record(chapter, chapter_inputs(start_page, end_page, title))
                     num_pages = end_page - start_page + 1
                     num_words = len(extracted_text.split())
                     num_questions = round(num_words / self.cfg.num_words_per_question)
-                    res.append([chapter, num_pages, num_questions, title])
+                    res[i] = [chapter, num_pages, num_questions, title]
+                page_cache.log_stats()
+                log.info(f"{manifest.skipped} unchanged chapters skipped")
         except Exception as e:
             raise PdfExtractionError(f"Error extracting chapter text from PDF: {str(e)}")
         return res
@@ -0,0 +1,77 @@
+#
+# pdf text extraction backends
+#
+import pymupdf
+from pypdf import PdfReader
+
+
+class PdfExtractor:
+    """
+    common interface for the pdf text engines, so Pdf2Txt and the benchmark
+    don't care which library parses the pages.
+    """
+    name = None
+
+    def __init__(self, pdf_file):
+        self.pdf_file = pdf_file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def page_count(self):
+        raise NotImplementedError
+
+    def extract_page(self, page_num):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PypdfExtractor(PdfExtractor):
+    name = "pypdf"
+
+    def __init__(self, pdf_file):
+        super().__init__(pdf_file)
+        self.reader = PdfReader(pdf_file)
+
+    @property
+    def page_count(self):
+        return len(self.reader.pages)
+
+    def extract_page(self, page_num):
+        return self.reader.get_page(page_num).extract_text()
+
+
+class PymupdfExtractor(PdfExtractor):
+    name = "pymupdf"
+
+    def __init__(self, pdf_file):
+        super().__init__(pdf_file)
+        self.doc = pymupdf.open(pdf_file)
+
+    @property
+    def page_count(self):
+        return self.doc.page_count
+
+    def extract_page(self, page_num):
+        return self.doc.load_page(page_num).get_text()
+
+    def close(self):
+        self.doc.close()
+
+
+backends = {
+    PypdfExtractor.name: PypdfExtractor,
+    PymupdfExtractor.name: PymupdfExtractor,
+}
+
+
+def get_extractor(backend, pdf_file):
+    if backend not in backends:
+        raise ValueError(f"unknown pdf backend {backend}, expecting one of {list(backends)}")
+    return backends[backend](pdf_file)
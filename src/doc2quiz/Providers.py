@@ -0,0 +1,202 @@
+#
+# chat model factory for each --platform, plus an in-process fake provider for offline runs
+#
+import re
+import json
+import time
+import asyncio
+import logging
+import importlib
+
+from pydantic import ValidationError
+from pydantic_yaml import parse_yaml_raw_as
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from .ExampleYaml import example_yaml
+from .Quiz import Quiz, QuizPack
+from .QuizWire import WQuiz, WQuizPack, quiz_to_wire
+from .Tokens import count_tokens
+
+log = logging.getLogger()
+
+# platform -> factory(model, temperature, http_client, http_async_client, timeout) returning a chat model
+providers = {}
+
+# platforms whose chat model takes an openai json schema response_format, which --stream needs
+streaming_platforms = {"openai", "fake"}
+
+# platforms whose langchain chat class only needs model and temperature
+langchain_chat_classes = {
+    "ai21": ("langchain_ai21", "ChatAI21"),
+    "anthropic": ("langchain_anthropic", "ChatAnthropic"),
+    "aws": ("langchain_aws", "ChatBedrockConverse"),
+    "cohere": ("langchain_cohere", "ChatCohere"),
+    "databricks": ("databricks_langchain", "ChatDatabricks"),
+    "fireworks": ("langchain_fireworks", "ChatFireworks"),
+    "google-genai": ("langchain_google_genai", "ChatGoogleGenerativeAI"),
+    "google-vertexai": ("langchain_google_vertexai", "ChatVertexAI"),
+    "groq": ("langchain_groq", "ChatGroq"),
+    "mistralai": ("langchain_mistralai", "ChatMistralAI"),
+    "nvidia-ai-endpoints": ("langchain_nvidia_ai_endpoints", "ChatNVIDIA"),
+    "ollama": ("langchain_ollama", "ChatOllama"),
+    "together": ("langchain_together", "ChatTogether"),
+    "upstage": ("langchain_upstage", "ChatUpstage"),
+}
+
+
+def register_provider(platform, factory):
+    providers[platform] = factory
+
+
+def import_chat_class(module_name, class_name):
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        package = module_name.replace('_', '-')
+        raise ImportError(f"{module_name} is needed for this platform: pip install {package}") from e
+    return getattr(module, class_name)
+
+
+def openai_factory(model, temperature, http_client=None, http_async_client=None, timeout=None):
+    # the only provider that gets our http pools, the others keep their own sdk clients.
+    # without an explicit timeout the sdk waits on a hung request forever
+    chat_class = import_chat_class("langchain_openai", "ChatOpenAI")
+    return chat_class(model=model, temperature=temperature, include_response_headers=True, timeout=timeout,
+                      http_client=http_client, http_async_client=http_async_client)
+
+
+def langchain_factory(module_name, class_name):
+    def factory(model, temperature, http_client=None, http_async_client=None, timeout=None):
+        return import_chat_class(module_name, class_name)(model=model, temperature=temperature)
+    return factory
+
+
+def huggingface_factory(model, temperature, http_client=None, http_async_client=None, timeout=None):
+    endpoint = import_chat_class("langchain_huggingface", "HuggingFaceEndpoint")(repo_id=model, temperature=temperature)
+    return import_chat_class("langchain_huggingface", "ChatHuggingFace")(llm=endpoint)
+
+
+def get_chat_model(platform, model, temperature=0, http_client=None, http_async_client=None, timeout=None):
+    if platform not in providers:
+        raise ValueError(f"no chat provider for platform {platform}, known: {' '.join(sorted(providers))}")
+    return providers[platform](model, temperature, http_client, http_async_client, timeout)
+
+
+def parse_target(target, default_platform):
+    """
+    split a "platform:model" target, a bare model name uses default_platform.
+    model names can have colons too (llama3:8b), so only a known platform is split off.
+    """
+    platform, sep, model = target.partition(":")
+    if sep and platform in providers:
+        return platform, model
+    return default_platform, target
+
+
+def json_schema_format(schema):
+    """
+    response_format asking an openai compatible api for json matching the pydantic schema
+    """
+    return {"type": "json_schema", "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema()}}
+
+
+def example_response(prompt, schema):
+    """
+    default answer of the fake provider: the prompt example quiz, one copy per packed section
+    """
+    quiz = parse_yaml_raw_as(Quiz, example_yaml)
+    if schema in (QuizPack, WQuizPack):
+        chapters = re.findall(r"=== section (\S+) :", prompt)
+        if schema is WQuizPack:
+            sections = [{"c": chapter, "i": quiz_to_wire(quiz).model_dump(mode="json")["i"]} for chapter in chapters]
+            return json.dumps({"s": sections})
+        sections = [{"chapter": chapter, "questions": quiz.questions.model_dump()} for chapter in chapters]
+        return json.dumps({"sections": sections})
+    if schema is WQuiz:
+        return quiz_to_wire(quiz).model_dump_json()
+    return quiz.model_dump_json()
+
+
+class FakeChatModel:
+    """
+    In-process stand in for a chat api, for offline tests and dry runs. Each prompt
+    is answered with responder(prompt, schema), which returns the json content, after
+    latency seconds. Responses carry usage and rate limit headers like a real provider.
+    """
+    def __init__(self, model="fake", temperature=0, responder=example_response, latency=0.0, headers=None):
+        self.model = model
+        self.responder = responder
+        self.latency = latency
+        self.headers = headers or {}
+        self.prompts = []
+
+    def with_structured_output(self, schema, include_raw=True):
+        return FakeStructuredModel(self, schema)
+
+    def bind(self, response_format=None, **kwargs):
+        schemas = {schema.__name__: schema for schema in (Quiz, WQuiz, QuizPack, WQuizPack)}
+        return FakeStreamingModel(self, schemas[response_format["json_schema"]["name"]])
+
+    def respond(self, prompt, schema):
+        self.prompts.append(prompt)
+        content = self.responder(prompt, schema)
+        input_tokens = count_tokens(prompt, "gpt-4o")
+        output_tokens = count_tokens(content, "gpt-4o")
+        raw = AIMessage(content=content,
+                        response_metadata={"headers": self.headers, "model_name": self.model},
+                        usage_metadata={"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                        "total_tokens": input_tokens + output_tokens})
+        try:
+            parsed = schema.model_validate_json(content)
+        except ValidationError as e:
+            return {'raw': raw, 'parsed': None, 'parsing_error': e}
+        return {'raw': raw, 'parsed': parsed, 'parsing_error': None}
+
+
+class FakeStructuredModel:
+    def __init__(self, chat_model, schema):
+        self.chat_model = chat_model
+        self.schema = schema
+
+    def invoke(self, prompt):
+        time.sleep(self.chat_model.latency)
+        return self.chat_model.respond(prompt, self.schema)
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self.chat_model.latency)
+        return self.chat_model.respond(prompt, self.schema)
+
+
+class FakeStreamingModel:
+    """
+    streams the fake answer in small chunks, with usage on the last one like openai's stream_usage
+    """
+    chunk_size = 20
+
+    def __init__(self, chat_model, schema):
+        self.chat_model = chat_model
+        self.schema = schema
+
+    def chunks(self, prompt):
+        res = self.chat_model.respond(prompt, self.schema)
+        content = res['raw'].content
+        for start in range(0, len(content), self.chunk_size):
+            yield AIMessageChunk(content=content[start:start + self.chunk_size])
+        yield AIMessageChunk(content="", usage_metadata=res['raw'].usage_metadata)
+
+    def stream(self, prompt):
+        time.sleep(self.chat_model.latency)
+        yield from self.chunks(prompt)
+
+    async def astream(self, prompt):
+        await asyncio.sleep(self.chat_model.latency)
+        for chunk in self.chunks(prompt):
+            yield chunk
+
+
+register_provider("openai", openai_factory)
+for platform, (module_name, class_name) in langchain_chat_classes.items():
+    register_provider(platform, langchain_factory(module_name, class_name))
+register_provider("huggingface", huggingface_factory)
+register_provider("fake", lambda model, temperature, http_client=None, http_async_client=None, timeout=None:
+                  FakeChatModel(model, temperature))
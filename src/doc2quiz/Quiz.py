@@ -102,6 +102,15 @@ class Questions(BaseModel):
 class Quiz(BaseModel):
     questions: Questions
 
+
+class SectionQuiz(BaseModel):
+    chapter: str
+    questions: Questions
+
+
+class QuizPack(BaseModel):
+    sections: List[SectionQuiz]
+
 # Example usage
 
 
@@ -0,0 +1,131 @@
+#
+# compact structured output schema for the llm call, expanded back into Quiz
+#
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from .Quiz import Quiz, QuizPack
+
+
+class TypeCode(str, Enum):
+    matching = "m"
+    multiple_answers = "ma"
+    multiple_choice = "mc"
+    multiple_dropdowns = "md"
+    short_answer = "sa"
+    true_false = "tf"
+
+
+class WPair(BaseModel):
+    k: str = Field(description="key")
+    v: str = Field(description="value")
+    x: Optional[str] = Field(default=None, description="explanation")
+
+
+class WOption(BaseModel):
+    o: str = Field(description="option")
+    x: str = Field(description="explanation")
+    a: bool = Field(default=False, description="true if this option is a correct answer")
+
+
+class WDropdown(BaseModel):
+    d: str = Field(description="dropdown")
+    o: List[WOption] = Field(description="options")
+
+
+class WItem(BaseModel):
+    t: TypeCode = Field(description="type: m=matching ma=multiple_answers mc=multiple_choice "
+                                    "md=multiple_dropdowns sa=short_answer tf=true_false")
+    id: Optional[str] = Field(default=None, description="ident")
+    ti: str = Field(description="title")
+    p: str = Field(description="prompt")
+    pt: int = Field(description="points")
+    pr: Optional[List[WPair]] = Field(default=None, description="pairs")
+    o: Optional[List[WOption]] = Field(default=None, description="options")
+    d: Optional[List[WDropdown]] = Field(default=None, description="dropdowns")
+    an: Optional[List[str]] = Field(default=None, description="answers")
+    a: Optional[bool] = Field(default=None, description="answer")
+    x: str = Field(description="explanation")
+    q: List[str] = Field(description="quotes")
+
+
+class WQuiz(BaseModel):
+    ti: Optional[str] = Field(default=None, description="title")
+    id: Optional[str] = Field(default=None, description="ident")
+    i: List[WItem] = Field(description="items")
+
+
+class WSection(BaseModel):
+    c: str = Field(description="chapter, the section id")
+    i: List[WItem] = Field(description="items")
+
+
+class WQuizPack(BaseModel):
+    s: List[WSection] = Field(description="sections")
+
+
+# short wire key -> Quiz field name, plus the same mapping for nested lists
+pair_spec = ({"k": "key", "v": "value", "x": "explanation"}, {})
+option_spec = ({"o": "option", "x": "explanation", "a": "answer"}, {})
+dropdown_spec = ({"d": "dropdown", "o": "options"}, {"o": option_spec})
+item_spec = ({"t": "type", "id": "ident", "ti": "title", "p": "prompt", "pt": "points", "pr": "pairs",
+              "o": "options", "d": "dropdowns", "an": "answers", "a": "answer", "x": "explanation", "q": "quotes"},
+             {"pr": pair_spec, "o": option_spec, "d": dropdown_spec})
+
+
+def rename(data, spec):
+    keys, children = spec
+    out = {}
+    for key, value in data.items():
+        if value is None:
+            continue
+        if key in children and isinstance(value, list):
+            value = [rename(entry, children[key]) for entry in value]
+        out[keys[key]] = value
+    return out
+
+
+def invert(spec):
+    keys, children = spec
+    return ({value: key for key, value in keys.items()},
+            {keys[key]: invert(child) for key, child in children.items()})
+
+
+item_spec_inverse = invert(item_spec)
+
+
+def expand_item(witem):
+    data = rename(witem.model_dump(mode="json", exclude_none=True), item_spec)
+    data["type"] = TypeCode(data["type"]).name
+    return data
+
+
+def compact_item(item):
+    data = rename(item.model_dump(exclude_none=True), item_spec_inverse)
+    data["t"] = TypeCode[data["t"]].value
+    return WItem.model_validate(data)
+
+
+def wire_to_quiz(wquiz):
+    """
+    expand a WQuiz into a Quiz, running all the Item validators
+    """
+    questions = {"items": [expand_item(witem) for witem in wquiz.i]}
+    if wquiz.ti is not None:
+        questions["title"] = wquiz.ti
+    if wquiz.id is not None:
+        questions["ident"] = wquiz.id
+    return Quiz.model_validate({"questions": questions})
+
+
+def quiz_to_wire(quiz):
+    return WQuiz(ti=quiz.questions.title, id=quiz.questions.ident,
+                 i=[compact_item(item) for item in quiz.questions.items])
+
+
+def wire_to_pack(wpack):
+    sections = [{"chapter": section.c, "questions": {"items": [expand_item(witem) for witem in section.i]}}
+                for section in wpack.s]
+    return QuizPack.model_validate({"sections": sections})
@@ -0,0 +1,163 @@
+#
+# client side pacing of llm requests
+#
+import re
+import time
+import asyncio
+import logging
+import threading
+
+log = logging.getLogger()
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilling capacity units per minute. A bucket without a
+    capacity doesn't limit anything until the provider's headers tell us the limit.
+    """
+    def __init__(self, capacity=None):
+        self.capacity = None
+        self.rate = None
+        self.level = 0.0
+        self.updated = time.monotonic()
+        if capacity:
+            self.set_capacity(capacity)
+            self.level = float(capacity)
+
+    def set_capacity(self, capacity):
+        if self.capacity is None:
+            self.level = float(capacity)
+        self.capacity = float(capacity)
+        self.rate = self.capacity / 60.0
+
+    def refill(self):
+        now = time.monotonic()
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        seconds until amount can be consumed, requests bigger than the bucket only wait for a full bucket
+        """
+        self.refill()
+        if self.capacity is None:
+            return 0.0
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount):
+        if self.capacity is not None:
+            # a negative amount gives back an overestimate, never past a full bucket
+            self.level = min(self.capacity, self.level - amount)
+
+    def sync_remaining(self, remaining, reset_seconds=None):
+        """
+        the provider's count is authoritative, but only ever lower our estimate:
+        requests still in flight aren't in its number yet
+        """
+        self.refill()
+        if self.capacity is None:
+            return
+        self.level = min(self.level, float(remaining))
+        if reset_seconds and remaining < self.capacity:
+            # the provider refills to capacity in reset_seconds, don't assume a faster rate than that
+            self.rate = min(self.capacity / 60.0, (self.capacity - remaining) / reset_seconds)
+        else:
+            self.rate = self.capacity / 60.0
+
+
+class RateLimiter:
+    """
+    Paces requests so both the requests/minute and tokens/minute limits stay just
+    under the provider's, instead of waiting for RateLimitError and backing off.
+    Limits come from --rpm/--tpm and are refined from x-ratelimit-* response headers.
+    """
+    def __init__(self, rpm=0, tpm=0, headroom=0.95):
+        self.headroom = headroom
+        self.requests = TokenBucket(rpm * headroom if rpm else None)
+        self.tokens = TokenBucket(tpm * headroom if tpm else None)
+        self.lock = threading.Lock()
+        self.async_lock = None
+        self.waited = 0.0
+
+    @staticmethod
+    def parse_duration(value):
+        """
+        openai style reset durations: 1s, 6m0s, 20ms, 1h2m3.5s
+        """
+        if value is None:
+            return None
+        units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+        matches = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", str(value))
+        if not matches:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+        return sum(float(number) * units[unit] for number, unit in matches)
+
+    def reserve(self, num_tokens):
+        """
+        take a request slot and num_tokens if both are available, otherwise return seconds to wait
+        """
+        with self.lock:
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(num_tokens))
+            if wait <= 0:
+                self.requests.consume(1)
+                self.tokens.consume(num_tokens)
+            return wait
+
+    def wait_time(self, num_tokens):
+        """
+        seconds until a request of num_tokens could go, without reserving anything
+        """
+        with self.lock:
+            return max(self.requests.wait_time(1), self.tokens.wait_time(num_tokens))
+
+    def settle(self, reserved, used):
+        """
+        charge the difference once the provider reports how many tokens a request really used
+        """
+        with self.lock:
+            self.tokens.refill()
+            self.tokens.consume(used - reserved)
+
+    def acquire(self, num_tokens):
+        while True:
+            wait = self.reserve(num_tokens)
+            if wait <= 0:
+                return
+            self.waited += wait
+            time.sleep(wait)
+
+    async def acquire_async(self, num_tokens):
+        # one waiter at a time keeps requests in fifo order instead of racing for the bucket
+        if self.async_lock is None:
+            self.async_lock = asyncio.Lock()
+        async with self.async_lock:
+            while True:
+                wait = self.reserve(num_tokens)
+                if wait <= 0:
+                    return
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        if not headers:
+            return
+        headers = {key.lower(): value for key, value in headers.items()}
+        with self.lock:
+            for name, bucket in (("requests", self.requests), ("tokens", self.tokens)):
+                limit = headers.get(f"x-ratelimit-limit-{name}")
+                remaining = headers.get(f"x-ratelimit-remaining-{name}")
+                reset = self.parse_duration(headers.get(f"x-ratelimit-reset-{name}"))
+                try:
+                    if limit is not None:
+                        bucket.set_capacity(float(limit) * self.headroom)
+                    if remaining is not None:
+                        bucket.sync_remaining(float(remaining) * self.headroom, reset)
+                except ValueError:
+                    log.debug(f"ignoring malformed rate limit header for {name}: {limit} {remaining}")
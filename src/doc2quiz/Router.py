@@ -0,0 +1,60 @@
+#
+# latency tracking per provider/model and routing of requests to the fastest one
+#
+import bisect
+import logging
+from collections import Counter, deque
+
+log = logging.getLogger()
+
+
+class LatencyHistogram:
+    """
+    Request latencies of one target: counts in doubling buckets for the run report,
+    and a window of recent samples for percentiles that follow the current load.
+    """
+    bounds = (1, 2, 4, 8, 16, 32, 64)
+
+    def __init__(self, window=100):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.recent = deque(maxlen=window)
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.recent.append(seconds)
+
+    def percentile(self, pct):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    @classmethod
+    def labels(cls):
+        edges = (0,) + cls.bounds
+        return [f"{low}-{high}s" for low, high in zip(edges, cls.bounds)] + [f">{cls.bounds[-1]}s"]
+
+
+class Router:
+    """
+    Sends each request to the target (platform:model) with the lowest recent p50
+    latency among those whose rate limiter has room for it right now. Targets
+    without samples go first, so every one gets measured early in the run.
+    """
+    def __init__(self, targets, latency, get_rate_limiter):
+        self.targets = list(targets)
+        self.latency = latency
+        self.get_rate_limiter = get_rate_limiter
+        self.picks = Counter()
+
+    def pick(self, num_tokens):
+        ready = [target for target in self.targets
+                 if self.get_rate_limiter(target).wait_time(num_tokens) <= 0] or self.targets
+        unmeasured = [target for target in ready if self.latency[target].percentile(50) is None]
+        if unmeasured:
+            target = min(unmeasured, key=lambda target: self.picks[target])
+        else:
+            target = min(ready, key=lambda target: self.latency[target].percentile(50))
+        self.picks[target] += 1
+        log.debug(f"routing request to {target}")
+        return target
@@ -1,178 +1,93 @@
 #!/usr/bin/env python3
 import os
-import sys
+import math
+import json
+import time
 import regex
-import wordninja
-import string
 import logging
-from collections import defaultdict
-from neofuzz import Process
-from sklearn.feature_extraction.text import TfidfVectorizer
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from .Utils import Utils
+import threading
+from collections import Counter, defaultdict
+from .Cache import SqliteCache
+from .ExactMatcher import ExactMatcher
+from .Manifest import Manifest
+from .MyersMatcher import MyersMatcher, lowercase
+from .Normalizer import Normalizer
+from .PassageIndex import PassageIndex
 
 # from prettytable import PrettyTable
 log = logging.getLogger()
 
 
 class Search:
+    top_windows = 3
+    # part of every quote cache key, bump it whenever a change to the matching moves results
+    algorithm_version = 4
+
     def __init__(self, cfg):
         self.cfg = cfg
         self.debug_match = True
-
-    def run_nprocess(self, ident, search_string, passage):
-        n_chars = len(search_string)
-        min_chunk_size = 200
-        chunk_size = max(1.5 * n_chars, min_chunk_size)
-        log.debug(f"min chunk size = {chunk_size}")
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_size / 2,
-            length_function=len,
-            is_separator_regex=False,
-        )
-        docs = text_splitter.create_documents([passage])
-        sentences = [doc.page_content for doc in docs]
-
-        Utils.set_logging_level(logging.INFO)
-        vectorizer = TfidfVectorizer()
-        # self.nprocess = char_ngram_process()
-        nprocess = Process(vectorizer, metric="cosine")
-        nprocess.index(sentences)
-        Utils.set_logging_level(logging.DEBUG)
-        log.debug("running extractOne")
-        best_match, similarity = nprocess.extractOne(search_string)
-        log.debug("------------")
-        log.debug(f"fm quote      {ident}: {search_string}")
-        log.debug(f"fm Best match {ident}: {best_match}")
-        log.debug(f"fm Similarity:{ident}: {similarity}")
-        if self.debug_match:
-            if similarity < 10:
-                file_name = "logs/search_debug.log"
-                os.makedirs(os.path.dirname(file_name), exist_ok=True)
-                with open(file_name, 'w', encoding='utf-8') as file:
-                    for i, line in enumerate(sentences):
-                        file.write(f"{i}:{line}\n")
-                breakpoint()
-        return best_match, similarity
-
-    def find_fuzzy_and_regex(self, ident, passage, search_string):
+        self.normalizer = Normalizer()
+        self.paragraph_normalizer = Normalizer(keep_paragraphs=True)
+        self.matcher = MyersMatcher()
+        # quotes resolved by each tier (exact, fuzzy, missing) and the time spent in it
+        self.tier_counts = Counter()
+        self.tier_seconds = defaultdict(float)
+        self.quote_cache = None
+        self.lock = threading.Lock()
+
+    def dump_windows(self, index):
+        file_name = "logs/search_debug.log"
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(file_name, 'w', encoding='utf-8') as file:
+            for i, line in enumerate(index.windows):
+                file.write(f"{i}:{line}\n")
+
+    def find_fuzzy_and_regex(self, ident, passage, search_string, windows):
         """
-        find the closest matching sentence
-        each sentence is a snippet of the same length as search string
+        refine the closest tf-idf windows of search_string with a fuzzy regex search
+        and keep the match with the fewest edits. returns (start, end, num_err, tier), tier
+        "fuzzy" for a match within the edit budget and "window", with num_err None, when only
+        a similar window was found
         """
         threshold = 10
-        n_chars = len(search_string)
+        padding_chars = 100
 
         log.debug(f"search_string: {search_string}")
-        best_match, similarity = self.run_nprocess(ident, search_string, passage)
-
-        if best_match and similarity > threshold:
-            # Find the starting index of the match in the original passage
-            find_idx = passage.find(best_match)
-        else:
-            find_idx = -1
-            if self.debug_match:
-                log.debug("No reasonable match found. Using the entire text.")
-        # create partial string and offset
-        if find_idx >= 0:
-            start_idx = find_idx
-            end_idx = find_idx + n_chars
-        else:
-            start_idx = 0
-            end_idx = len(passage)
-           
-        # refine the search if regex_search if defined
-        if find_idx == -1:
-            if self.debug_match:
-                partial_text = passage[start_idx:end_idx]
-                if len(partial_text) > 5000:
-                    log.debug(f"fm:partial_text length {len(partial_text)} so return None")
-                else:
-                    log.debug(f"fm : partial_text = {partial_text} so return None")
-            return None, None, None
-
-        # do regex search
-        if find_idx >= 0:
-            padding_chars = 100
+        best = None
+        for start_idx, end_idx, similarity in windows:
+            log.debug(f"fm window {ident}: similarity {similarity:.1f} at {start_idx}")
+            if similarity <= threshold:
+                break
             start_idx = max(start_idx - padding_chars, 0)
             end_idx = min(end_idx + padding_chars, len(passage))
-            if self.debug_match:
-                partial_text = passage[start_idx:end_idx]
-                if len(partial_text) > 5000:
-                    log.debug(f"fm:regex_search using partial_text length {len(partial_text)} ")
-                else:
-                    log.debug(f"fm :regex_search using partial_text = {partial_text}")
-
-        partial_text = passage[start_idx:end_idx]
-        beg_loc, end_loc, num_err = self.find_regex(partial_text, search_string)
-        if beg_loc is not None and end_loc is not None:
-            beg_loc += start_idx
-            end_loc += start_idx
-            return beg_loc, end_loc, num_err
-
-        if find_idx >= 0:
-            return start_idx, end_idx, similarity
-        else:
-            return None, None, None
-
-    def preprocess_hyphen_newline(self, text, hyphen_newline=' -\n', replacement=''):
-        """
-        Removes all occurrences of a string like ' -\n' from the given text and keeps track of positions.
-
-        Parameters:
-        text (str): The input text.
-
-        Returns:
-        tuple: A tuple containing the preprocessed text and a list of positions where ' -\n' was removed.
-        """
-        positions = []
-        preprocessed_text = ""
-        i = 0
-        while i < len(text):
-            if text[i:i + len(hyphen_newline)] == hyphen_newline:
-                positions.append(i)
-                i += len(hyphen_newline)
-                preprocessed_text += replacement
-            else:
-                preprocessed_text += text[i]
-                i += 1
-        return preprocessed_text, positions
+            beg_loc, end_loc, num_err = self.find_regex(passage[start_idx:end_idx], search_string)
+            if beg_loc is not None and (best is None or num_err < best[2]):
+                best = (beg_loc + start_idx, end_loc + start_idx, num_err)
+                if num_err == 0:
+                    break
+        if best is not None:
+            return best + ("fuzzy",)
+
+        if windows and windows[0][2] > threshold:
+            # no regex match, settle for the start of the closest window
+            start_idx, end_idx, similarity = windows[0]
+            return start_idx, min(start_idx + len(search_string), len(passage)), None, "window"
+        if self.debug_match:
+            log.debug("No reasonable match found.")
+        return None, None, None, "missing"
 
-    def reinsert_hyphen_newline(self, text, positions, target_string, hyphen_newline=' -\n', replacement=''):
+    def compact_text(self, text):
         """
-        Re-inserts ' -\n' back into the text at the specified positions, adjusted for offset.
-
-        Parameters:
-        text (str): The input text.
-        positions (list): The list of positions where ' -\n' was removed.
-        offset (int): The offset to adjust positions.
-
-        Returns:
-        str: The text with ' -\n' re-inserted.
+        Undo pdf extraction artifacts before text goes into a prompt, with the same
+        Normalizer rules the quote search uses, except that paragraph breaks are kept.
         """
-        offset = text.index(target_string)
-        length = len(target_string)
-        snippet = text[offset:offset + length]
-
-        accumulated_spaces = 0
-        for pos in positions:
-            adjusted_pos = pos - offset - accumulated_spaces
-            if adjusted_pos < 0:
-                accumulated_spaces += len(hyphen_newline) - len(replacement)
-            elif adjusted_pos < len(snippet):
-                snippet = snippet[:adjusted_pos] + hyphen_newline + snippet[adjusted_pos + len(replacement):]
-            else:
-                # adjusted_pos is past the snippet..
-                return snippet
+        return self.paragraph_normalizer.normalize(text).text.strip()
 
-        # in case positions is empty
-        return snippet
-        
     def find_regex(self, passage, search_string):
         """
         Find the approximate match of a search_string in passage using regex with fuzzy matching.
         The function loops over max_edits from 0 upwards until a match is found.
+        With cfg.match_backend "myers" (the default) a bit-parallel matcher finds it in one scan.
         
         Parameters:
             passage (str): The large text to search in.
@@ -180,7 +95,8 @@ class Search:
             max_allowed_edits (int): The maximum number of edits to attempt before stopping.
         
         Returns:
-            (start_index, end_index, max_edits): A tuple with the start and end index of the match and the number of edits used.
+            (start_index, end_index, max_edits): A tuple with the start and end index of the match
+            and the number of edits used.
         """
         if self.debug_match:
             log.debug(f"find_regex : search string={search_string}")
@@ -191,66 +107,140 @@ class Search:
 
         # limit max_edits to 10 or 10% of short quote
         max_edits = min(10, len(search_string) * 0.1)
+        if self.match_backend() == "myers":
+            return self.find_myers(passage, search_string, max_edits)
+        match = None
         edits = 0
         while edits < max_edits:
             # Build the fuzzy search pattern with regex allowing for `max_edits` edits.
             pattern = f"(?e)(?i)({regex.escape(search_string)}){{e<={edits}}}"
             edits += 1
-            if self.debug_match:
-                print(f" {edits} ", end="", flush=True)
-                sys.stdout.flush()
             match = regex.search(pattern, passage)
-
             if match:
                 log.debug(f" match: {match}")
-                # Re-insert ' -\n' back into the matched string
-                matched_string = match.group(0)
-                match_start = match.start(0)
-                try:
-                    match_start = passage.index(matched_string)
-                except ValueError:
-                    breakpoint()
-                    return None, None, None
-                match_end = match_start + len(matched_string)
-                return match_start, match_end, sum(match.fuzzy_counts)
+                return match.start(0), match.end(0), sum(match.fuzzy_counts)
 
         log.debug(f" match: {match} max_edits={max_edits}")
         # give up
         return None, None, None
 
-    def find_quote_in_passage(self, ident, passage, search_string):
+    def match_backend(self):
+        return getattr(self.cfg, "match_backend", "myers")
+
+    def find_myers(self, passage, search_string, max_edits):
         """
+        same answer as the escalating fuzzy regex, the fewest edits below max_edits,
+        from a single bit-parallel scan
         """
-        # modify original text to remove pdf extraction artifacts
-        intext1, positions1 = self.preprocess_hyphen_newline(passage, hyphen_newline=' -\n')
-        intext2, positions2 = self.preprocess_hyphen_newline(intext1, hyphen_newline='-\n')
-        intext3, positions3 = self.preprocess_hyphen_newline(intext2, hyphen_newline='\n', replacement=' ')
-        intext4, positions4 = self.preprocess_joinedwords(intext3)
+        found = self.matcher.search(passage, search_string, max_edits=math.ceil(max_edits) - 1)
+        if found is None:
+            log.debug(f" no match with fewer than {max_edits} edits")
+            return None, None, None
+        return found
 
-        beg_loc, end_loc, num_err = self.find_fuzzy_and_regex(ident, intext4, search_string)
+    def get_quote_cache(self):
+        # opened on first use, a Search that never locates quotes doesn't touch the disk.
+        # SqliteCache can be shared by threads, the lock keeps them from opening two
+        with self.lock:
+            if self.quote_cache is None and not getattr(self.cfg, "no_quote_cache", True):
+                self.quote_cache = SqliteCache(f"{self.cfg.output_dir_cache}/quotes.sqlite")
+            return self.quote_cache
 
-        if beg_loc is None or end_loc is None:
+    def quote_cache_key(self, passage_hash, quote):
+        return Manifest.digest(self.algorithm_version, self.match_backend(), self.top_windows, passage_hash, quote)
+
+    def get_cached_locations(self, passage_hash, quotes):
+        """
+        {quote number: (beg, end, num_err, tier)} in the normalized passage, for the quotes located before
+        """
+        found = {}
+        cache = self.get_quote_cache()
+        if cache is None:
+            return found
+        for num, quote in enumerate(quotes):
+            value = cache.get(self.quote_cache_key(passage_hash, quote))
+            if value is not None:
+                found[num] = tuple(json.loads(value))
+        return found
+
+    def put_cached_locations(self, passage_hash, quotes, found):
+        cache = self.get_quote_cache()
+        if cache is None:
+            return
+        for num, location in found.items():
+            cache.put(self.quote_cache_key(passage_hash, quotes[num]), json.dumps(location))
+
+    def locate_quotes(self, ident, passage, quotes, strict=False):
+        """
+        (start, end, num_err) in passage of each quote, or (None, None, None) when it isn't there.
+        the passage is normalized once, quotes located in an earlier run come from the quote
+        cache, the rest are first looked up verbatim in one aho-corasick scan and only what
+        is left goes through the tf-idf index and fuzzy match. strict only accepts exact
+        matches and those within the edit budget, not the closest window of similar words
+        """
+        start = time.perf_counter()
+        normalized = self.normalizer.normalize(passage)
+        # quotes get the same normalization, so a quote copied across a line end still matches verbatim
+        quotes = [self.normalizer.normalize(quote).text.strip() for quote in quotes]
+        passage_hash = Manifest.digest(normalized.text)
+        cached = self.get_cached_locations(passage_hash, quotes)
+        self.tier_counts["cached"] += len(cached)
+        self.tier_seconds["cached"] += time.perf_counter() - start
+
+        # (beg, end, num_err, tier) in the normalized passage of each newly located quote
+        found = {}
+        start = time.perf_counter()
+        remaining = [num for num in range(len(quotes)) if num not in cached]
+        exact = ExactMatcher([lowercase(quotes[num]) for num in remaining]).first_matches(lowercase(normalized.text))
+        for pattern_num, beg_loc in exact.items():
+            num = remaining[pattern_num]
+            found[num] = (beg_loc, beg_loc + len(quotes[num]), 0, "exact")
+        self.tier_counts["exact"] += len(exact)
+        self.tier_seconds["exact"] += time.perf_counter() - start
+
+        remaining = [num for num in remaining if num not in found]
+        if remaining:
+            start = time.perf_counter()
+            fuzzy_quotes = [quotes[num] for num in remaining]
+            index = PassageIndex(normalized.text, max(len(quote) for quote in fuzzy_quotes))
+            top_windows = index.top_windows(fuzzy_quotes, k=self.top_windows)
+            # the index and batch lookup are shared, each quote pays an even part of them
+            shared_seconds = (time.perf_counter() - start) / len(remaining)
+            for num, quote, windows in zip(remaining, fuzzy_quotes, top_windows):
+                start = time.perf_counter()
+                found[num] = self.find_fuzzy_and_regex(ident, normalized.text, quote, windows)
+                tier = found[num][3]
+                if tier == "missing" and self.debug_match:
+                    log.debug(f"locate_quotes {ident}: empty handed for {quote}")
+                    self.dump_windows(index)
+                # charged to the tier the quote ended in, so window and missing show their own cost
+                self.tier_counts[tier] += 1
+                self.tier_seconds[tier] += shared_seconds + time.perf_counter() - start
+        self.put_cached_locations(passage_hash, quotes, found)
+
+        locations = []
+        for num in range(len(quotes)):
+            beg_loc, end_loc, num_err, tier = cached[num] if num in cached else found[num]
+            if beg_loc is None or (strict and tier == "window"):
+                locations.append((None, None, None))
+                continue
+            match_start, match_end = normalized.span(beg_loc, end_loc)
             if self.debug_match:
-                log.debug("find_quote_in_passage : empty handed")
-            return None, None, None
-    
-        matched_string = intext4[beg_loc:end_loc]
-
-        snippet1 = self.reinsert_joinedwords(intext4, positions4, matched_string)
-        snippet2 = self.reinsert_hyphen_newline(intext3, positions3, snippet1, hyphen_newline='\n', replacement=' ')
-        snippet3 = self.reinsert_hyphen_newline(intext2, positions2, snippet2, hyphen_newline='-\n')
-        snippet4 = self.reinsert_hyphen_newline(intext1, positions1, snippet3, hyphen_newline=' -\n')
-        try:
-            match_start = passage.index(snippet4)
-        except ValueError:
-            breakpoint()
-            return None, None, None
-        match_end = match_start + len(snippet3)
-        # log.debug(f" match_start = {match_start}")
-        # Return the start and end index of the match and the number of edits used
-        if self.debug_match:
-            log.debug(f"find_quote_in_passage : found q={snippet4}")
-        return match_start, match_end, num_err
+                log.debug(f"locate_quotes {ident}: {tier} q={passage[match_start:match_end]}")
+            locations.append((match_start, match_end, num_err))
+        return locations
+
+    def close(self):
+        if self.quote_cache is not None:
+            self.quote_cache.close()
+            self.quote_cache = None
+
+    def find_quote_in_passage(self, ident, passage, search_string):
+        """
+        find search_string in passage after removing pdf extraction artifacts,
+        returns the (start, end) of the match in the original passage
+        """
+        return self.locate_quotes(ident, passage, [search_string])[0]
 
     def find_matching_blocks(self, blocks, quotes):
 
@@ -279,101 +269,26 @@ class Search:
         #   begg_idx>---------< end_idx
         #        beg_loc>---<end_loc
         matching_blocks = defaultdict(list)
-        for ident, ql in quotes.items():
-            for quote in ql:
-                blocks_per_quote = []
-                beg_loc, end_loc, num_err = self.find_quote_in_passage(ident, passage, quote)
-                # beg_loc, end_loc = quote.start_ptr + quote_ptr_offset, quote.end_ptr + quote_ptr_offset
-                # log.debug(f"\n------------------\nquote = {beg_loc}:{end_loc}")
-                if beg_loc is not None and end_loc is not None:
-                    for i, (beg_idx, end_idx) in block_number_map.items():
-                        case1 = beg_idx >= beg_loc and beg_idx <= end_loc
-                        case2 = end_idx >= beg_loc and end_idx <= end_loc
-                        case3 = beg_idx <= beg_loc and end_idx >= end_loc
-                        if case1 or case2 or case3:
-                            blocks_per_quote.append(blocks[i][:4])
-                        # if regex.match("Theodor Schwann",quote):
-                        #    log.debug(f"{beg_idx} v {beg_loc} and e={end_idx} v {end_loc} : {case1} {case2} {case3}")
-                    matching_blocks[ident].append(blocks_per_quote)
-                    log.debug(f"matching_blocks for ident {ident} = {len(matching_blocks[ident])}")
+        # all quotes of the page share one normalized and indexed passage
+        idents = [ident for ident, ql in quotes.items() for quote in ql]
+        all_quotes = [quote for ident, ql in quotes.items() for quote in ql]
+        locations = self.locate_quotes("page", passage, all_quotes)
+        for ident, (beg_loc, end_loc, num_err) in zip(idents, locations):
+            blocks_per_quote = []
+            if beg_loc is not None and end_loc is not None:
+                for i, (beg_idx, end_idx) in block_number_map.items():
+                    case1 = beg_idx >= beg_loc and beg_idx <= end_loc
+                    case2 = end_idx >= beg_loc and end_idx <= end_loc
+                    case3 = beg_idx <= beg_loc and end_idx >= end_loc
+                    if case1 or case2 or case3:
+                        blocks_per_quote.append(blocks[i][:4])
+                matching_blocks[ident].append(blocks_per_quote)
+                log.debug(f"matching_blocks for ident {ident} = {len(matching_blocks[ident])}")
         for ident, ql in quotes.items():
             if not matching_blocks[ident]:
                 log.debug(f" missing matcking block for {ql}")
         return matching_blocks
 
-    def preprocess_joinedwords(self, text):
-        """
-        Segments concatenated words using wordninja while maintaining spaces, newlines, punctuation,
-        numbers, and other non-alphabetic characters. Keeps track of positions where splits occur.
-
-        Parameters:
-        text (str): The input text with spaces, newlines, punctuation, numbers, and concatenated words.
-
-        Returns:
-        tuple: A tuple containing the preprocessed text and a list of positions where splits occurred.
-        """
-        positions = []
-        preprocessed_text = ""
-        i = 0
-        while i < len(text):
-            # Check for space, tab, or newline and preserve them
-            if text[i].isspace():
-                preprocessed_text += text[i]
-                i += 1
-            # Check for punctuation or numbers and preserve them as-is
-            elif text[i] in string.punctuation or text[i].isdigit():
-                preprocessed_text += text[i]
-                i += 1
-            else:
-                # Extract the next word-like segment (until encountering a space or special character)
-                start = i
-                while i < len(text):
-                    i += 1
-                word = text[start:i]
-                
-                # Use wordninja to split the word if it's a pure alphabetic word
-                if word.isalpha():
-                    split_words = wordninja.split(word)
-                    if len(split_words) > 1:  # Only track positions if a split occurred
-                        positions.append((len(preprocessed_text), word))  # Track original word position
-                    preprocessed_text += ' '.join(split_words)
-                else:
-                    # If it's not alphabetic, don't split it
-                    preprocessed_text += word
-        
-        return preprocessed_text, positions
-
-    def reinsert_joinedwords(self, text, positions, target_string):
-        """
-        Re-inserts original concatenated words back into a target snippet of the text starting at the given offset,
-        only reinserting spaces back in the provided target string.
-
-        Parameters:
-        text (str): The input text (with wordninja splits).
-        positions (list): The list of positions where original words were split.
-
-        Returns:
-        str: The snippet of text with spaces reinserted into concatenated words.
-        """
-        # Extract the target snippet from the text using the provided offset and length
-        offset = text.index(target_string)
-        length = len(target_string)
-        snippet = text[offset:offset + length]
-        log.debug(f"reinsert_joinedwords:  offset = {offset} len={length}")
-        
-        # Iterate over positions and find those that apply within the snippet range
-        for pos, original_word in positions:
-            adjusted_pos = pos - offset
-            if 0 <= adjusted_pos < len(snippet):
-                # Calculate the split length of the word (this is the space-inserted version length)
-                split_words = wordninja.split(original_word)
-                split_length = len(' '.join(split_words))  # Length of the split version with spaces
-                
-                # Replace the space-inserted version with the original concatenated word in the snippet
-                snippet = snippet[:adjusted_pos] + original_word + snippet[adjusted_pos + split_length:]
-        
-        return snippet
-
     def find_exact_quote(self, quote):
         """
             the quote string in self.text might not be exact...
@@ -392,15 +307,15 @@ def test_worksplit():
 
     log.debug(" test1: test_split")
     search = Search({})
-    intext1, positions1 = search.preprocess_joinedwords(text)
-    log.debug("Orig text       :", text)
-    log.debug("Preprocessed text:", intext1)
-    log.debug("Positions:", positions1)
+    normalized = Normalizer(split_joined_words=True).normalize(text)
+    log.debug(f"Orig text        : {text}")
+    log.debug(f"Normalized text  : {normalized.text}")
 
-    # Re-insert concatenated words starting from a given offset (e.g., at "spaceflightlaunch")
+    # map a match in the normalized text back to the original (e.g., at "spaceflight launch")
     target_string = "1. spaceflight launch"
-    snippet = search.reinsert_joinedwords(intext1, positions1, target_string)
-    log.debug("Reconstructed snippet:", snippet)
+    beg = normalized.text.index(target_string)
+    beg_loc, end_loc = normalized.span(beg, beg + len(target_string))
+    log.debug(f"Original snippet : {text[beg_loc:end_loc]}")
 
     log.debug(" test2: regex")
     search_string = "1. spaceflightlaunch"
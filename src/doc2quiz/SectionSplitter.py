@@ -0,0 +1,112 @@
+#
+# split chapter text that is too big for one request into balanced parts
+#
+import re
+import logging
+
+from .Tokens import count_tokens
+
+log = logging.getLogger()
+
+paragraph_break = re.compile(r'\n\s*\n')
+sentence_break = re.compile(r'(?<=[.!?])\s+')
+
+
+def pieces(pattern, text, separator):
+    """
+    text split at pattern, as (piece, separator before it) with the matched separators
+    kept. the first piece gets separator
+    """
+    pos = 0
+    for match in pattern.finditer(text):
+        yield text[pos:match.start()], separator
+        separator = match.group()
+        pos = match.end()
+    yield text[pos:], separator
+
+
+def split_units(text, max_tokens, model):
+    """
+    paragraphs as (text, tokens, separator before it). paragraphs over max_tokens are
+    broken into sentences, and sentences that are still too long into runs of words.
+    """
+    units = []
+    for paragraph, separator in pieces(paragraph_break, text, "\n\n"):
+        if not paragraph.strip():
+            continue
+        tokens = count_tokens(paragraph, model)
+        if tokens <= max_tokens:
+            units.append((paragraph, tokens, separator))
+            continue
+        for sentence, separator in pieces(sentence_break, paragraph, separator):
+            tokens = count_tokens(sentence, model)
+            if tokens <= max_tokens:
+                units.append((sentence, tokens, separator))
+                continue
+            units.extend(split_words(sentence, tokens, max_tokens, model, separator))
+    return units
+
+
+def split_words(sentence, tokens, max_tokens, model, separator=" "):
+    """
+    a sentence over max_tokens as the fewest runs of equal word counts that all fit
+    """
+    words = sentence.split()
+    num_runs = -(-tokens // max_tokens)
+    while True:
+        size = -(-len(words) // num_runs)
+        runs = [" ".join(words[start:start + size]) for start in range(0, len(words), size)]
+        counted = [(run, count_tokens(run, model), separator if num == 0 else " ") for num, run in enumerate(runs)]
+        if size == 1 or all(run_tokens <= max_tokens for run, run_tokens, run_separator in counted):
+            return counted
+        num_runs += 1
+
+
+def join_units(part):
+    """
+    the text of a part, each unit after the first one keeps its original separator
+    """
+    return "".join(unit if num == 0 else separator + unit for num, (unit, tokens, separator) in enumerate(part))
+
+
+def partition(units, num_parts):
+    """
+    cut the units into num_parts contiguous runs, each cut placed where the running
+    total is closest to the next multiple of total / num_parts
+    """
+    total = sum(tokens for unit, tokens, separator in units)
+    parts = []
+    part = []
+    running = 0
+    for unit, tokens, separator in units:
+        target = total * (len(parts) + 1) / num_parts
+        if part and len(parts) < num_parts - 1 and abs(running + tokens - target) > abs(running - target):
+            parts.append(part)
+            part = []
+        part.append((unit, tokens, separator))
+        running += tokens
+    parts.append(part)
+    return parts
+
+
+def split_section(text, max_tokens, model="gpt-4o"):
+    """
+    returns text as a list of parts of at most max_tokens tokens each, split at
+    paragraph (or failing that sentence) boundaries with token counts as even as possible.
+    the separators between units are kept, so sentences of one paragraph stay one paragraph.
+    text that already fits, or max_tokens <= 0, comes back as a single part.
+    """
+    total = count_tokens(text, model)
+    if max_tokens <= 0 or total <= max_tokens:
+        return [text]
+    units = split_units(text, max_tokens, model)
+    num_parts = -(-total // max_tokens)
+    while True:
+        # separators cost tokens too, so the limit is checked on the joined parts
+        parts = [join_units(part) for part in partition(units, num_parts)]
+        counts = [count_tokens(part, model) for part in parts]
+        if max(counts) <= max_tokens or num_parts >= len(units):
+            break
+        num_parts += 1
+    log.debug(f"split {total} tokens into {len(parts)} parts of {counts} tokens")
+    return parts
@@ -0,0 +1,49 @@
+#
+# local token counting, used to budget requests before they are sent
+#
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+log = logging.getLogger()
+
+# rough average for english prose when no tokenizer is available
+chars_per_token = 4
+encodings = {}
+
+
+def load_encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # non openai models: o200k is a reasonable stand in for budgeting
+        return tiktoken.get_encoding("o200k_base")
+
+
+def get_encoding(model):
+    if tiktoken is None:
+        return None
+    if model not in encodings:
+        try:
+            encodings[model] = load_encoding(model)
+        except Exception as e:
+            # tiktoken downloads its bpe files on first use, offline there is nothing to load
+            log.warning(f"no tokenizer for {model}, estimating tokens from characters: {e}")
+            encodings[model] = None
+    return encodings[model]
+
+
+def count_tokens(text, model="gpt-4o"):
+    """
+    number of tokens in text for model, falls back to a character estimate when
+    tiktoken or its encoding files aren't available
+    """
+    if not text:
+        return 0
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // chars_per_token)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -1,21 +1,40 @@
 #
 #
 #
+import os
 import sys
+import time
 import yaml
 import json
+import asyncio
 import logging
 import backoff
+import statistics
+from collections import defaultdict
+from prettytable import PrettyTable
 
 from .Utils import Utils
 from .ExampleYaml import example_yaml
-from .Quiz import Quiz
+from .Quiz import Quiz, Questions, QuizPack
+from .QuizWire import WQuiz, WQuizPack, quiz_to_wire, wire_to_quiz, wire_to_pack
 from .Search import Search
+from .Manifest import Manifest
+from .Journal import Journal
+from .RateLimiter import RateLimiter
+from .Tokens import count_tokens
+from .SectionSplitter import split_section
+from .Cache import SqliteCache
+from .BatchRunner import BatchRunner, OpenAIBatchService
+from .LlmClient import LlmClient
+from .Providers import parse_target
+from .Router import LatencyHistogram, Router
+from .Hedger import Hedger
+from .ItemRepair import ItemRepair
+from .ItemStream import ItemStream, StreamAborted
 
 import openai
 # import anthropic
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from pydantic_yaml import parse_yaml_raw_as
 
 log = logging.getLogger()
@@ -23,13 +42,52 @@ errors = (openai.RateLimitError)
 
 
 class Txt2Yaml:
+    # completion tokens assumed per request before any usage has been reported
+    default_output_tokens = 2000
+    # with --stream the in progress yaml is rewritten after this many new items
+    partial_yaml_items = 5
+
     def __init__(self, cfg):
         self.cfg = cfg
+        # the compact wire schema has short keys and type codes, which cuts output tokens
+        self.compact = cfg.wire_schema == "compact"
+        self.quiz_schema = WQuiz if self.compact else Quiz
+        self.pack_schema = WQuizPack if self.compact else QuizPack
         self.example_json = self.gen_example_json()
-        self.search = None
+        self.prompt_prefix = self.get_prompt_prefix()
+        self.search = Search(cfg)
+        # used to check that the quotes of cheap model answers are in the passage
+        self.quote_search = Search(cfg)
+        self.quote_search.debug_match = False
+        self.repair = ItemRepair(self.compact)
+        # one pooled client, rate limiter and latency histogram per platform:model target
+        self.main_target = self.target_name(cfg.model)
+        self.cascade_target = self.target_name(cfg.cascade_model) if cfg.cascade_model else None
+        self.llm_clients = {}
+        self.rate_limiters = {}
+        self.latency = defaultdict(LatencyHistogram)
+        self.router = None
+        if cfg.route:
+            self.router = Router([self.target_name(target) for target in cfg.route], self.latency,
+                                 self.get_rate_limiter)
+        self.tier_latency = defaultdict(list)
+        # title and items streamed so far of each chapter being generated with --stream
+        self.partial = {}
+        self.hedger = Hedger(cfg.request_timeout, cfg.hedge, cfg.hedge_budget)
+        self.manifest = Manifest(cfg, "txt_to_yaml")
+        self.journal = Journal(cfg, "txt_to_yaml")
+        self.stats = defaultdict(float)
+        self.temperature = 0
+        # any change to the Quiz schema changes what the llm returns, so it is part of the cache key
+        self.schema_versions = {}
+        self.llm_cache = None
+        if not cfg.no_llm_cache:
+            self.llm_cache = SqliteCache(f"{cfg.output_dir_cache}/llm.sqlite", cfg.llm_cache_mb << 20)
 
     def gen_example_json(self):
         quiz_parsed = parse_yaml_raw_as(Quiz, example_yaml)
+        if self.compact:
+            quiz_parsed = quiz_to_wire(quiz_parsed)
         quiz_cleaned = self.remove_optional_nulls(quiz_parsed)
         json_str = json.dumps(quiz_cleaned)
         return json_str
@@ -98,7 +156,7 @@ please try generating questions again, but this time convert all 50 questions
         """
         return prompt
 
-    def get_initial_prompt(self, text):
+    def get_num_questions(self, text):
         num_words = len(text.split())
         num_questions = round(num_words / self.cfg.num_words_per_question)
         num_questions = 10
@@ -109,9 +167,16 @@ please try generating questions again, but this time convert all 50 questions
                 return None
             else:
                 num_questions = 1
-        
+        return num_questions
+
+    def get_prompt_prefix(self):
+        """
+        Static start of every prompt. Providers reuse a cached prompt prefix across
+        requests, so this part must stay byte for byte the same for the whole run:
+        anything that varies per chapter goes after it.
+        """
         return f"""
-You are to produce {num_questions} questions from a passage.
+You are to produce questions from a passage.
 The questions should be of a mixture of the following types:
 
     matching
@@ -131,7 +196,15 @@ there must be at least one quote associated with the question.
 An example of output showing different question types:
 
 {self.example_json}
+"""
 
+    def get_initial_prompt(self, text, num_questions=None):
+        if num_questions is None:
+            num_questions = self.get_num_questions(text)
+        if num_questions is None:
+            return None
+
+        return self.prompt_prefix + f"""
 {num_questions} questions fron passage that starts here ->
 
 {text}
@@ -139,6 +212,82 @@ An example of output showing different question types:
 <- end of passage.
 """
 
+    def get_part_prompts(self, text):
+        """
+        [(text, prompt)] for the chapter, split into several parts when the text is over
+        cfg.max_section_tokens. the questions are shared out by the token count of each part.
+        """
+        num_questions = self.get_num_questions(text)
+        if num_questions is None:
+            return None
+        parts = split_section(text, self.cfg.max_section_tokens, self.cfg.model)
+        if len(parts) == 1:
+            return [(text, self.get_initial_prompt(text, num_questions))]
+        tokens = [count_tokens(part, self.cfg.model) for part in parts]
+        total = sum(tokens)
+        return [(part, self.get_initial_prompt(part, max(1, round(num_questions * part_tokens / total))))
+                for part, part_tokens in zip(parts, tokens)]
+
+    def get_pack_prompt(self, group):
+        """
+        one prompt for several small sections, each passage fenced by its chapter id
+        """
+        passages = ""
+        for chapter, title, text, inputs in group:
+            num_questions = self.get_num_questions(text)
+            passages += f"""
+=== section {chapter} : {num_questions} questions ===
+
+{text}
+
+=== end of section {chapter} ===
+"""
+        return self.prompt_prefix + f"""
+The {len(group)} passages below are separate sections.
+questions and quotes must only use the passage of their own section.
+Return one entry in sections for every passage, with chapter set to the section id
+and questions in the same format as the example.
+
+The passages are:
+{passages}"""
+
+    def pack_chapters(self, chapters):
+        """
+        group adjacent chapters into requests of at most cfg.pack_tokens passage tokens.
+        chapters over the budget are sent on their own.
+        """
+        groups = []
+        group = []
+        group_tokens = 0
+        for chapter in chapters:
+            tokens = count_tokens(chapter[2], self.cfg.model)
+            if group and group_tokens + tokens > self.cfg.pack_tokens:
+                groups.append(group)
+                group = []
+                group_tokens = 0
+            group.append(chapter)
+            group_tokens += tokens
+        if group:
+            groups.append(group)
+        return groups
+
+    def split_pack_res(self, group, res):
+        """
+        split a QuizPack answer back into per chapter results, None for sections the llm skipped
+        """
+        sections = {}
+        if res['parsing_error'] is None and res['parsed'] is not None:
+            sections = {section.chapter: section for section in res['parsed'].sections}
+        split = []
+        for chapter, title, text, inputs in group:
+            section = sections.get(chapter)
+            if section is None or not section.questions.items:
+                split.append(None)
+            else:
+                quiz = Quiz(questions=section.questions)
+                split.append({'raw': None, 'parsed': quiz, 'parsing_error': None})
+        return split
+
     def make_quotes_exact(self, quiz):
         for item in quiz["questions"]["items"]:
             log.debug(f" prompt: {item['prompt']}")
@@ -177,21 +326,436 @@ please try generating questions again with correct quote markers
             log.warn(f"Rate limit hit: {e}")
             raise  # Reraise exception for backoff to handle
 
-    def ask_questions_yaml(self, chapter, title, extracted_text):
+    # backoff also handles coroutines, so the async path gets the same retry policy
+    @backoff.on_exception(backoff.expo, errors, base=10, factor=2, max_tries=8)
+    async def get_structured_llm_res_async(self, structured_llm, prompt):
+        try:
+            return await structured_llm.ainvoke(prompt)
+        except errors as e:
+            log.warn(f"Rate limit hit: {e}")
+            raise  # Reraise exception for backoff to handle
 
-        self.search = Search(self.cfg)
+    def get_llm_client(self, target=None):
+        # built on first use, so runs answered entirely from cache never need an api key
+        target = target or self.main_target
+        if target not in self.llm_clients:
+            platform, model = parse_target(target, self.cfg.platform)
+            self.llm_clients[target] = LlmClient(self.cfg, temperature=self.temperature,
+                                                 timeout=self.cfg.request_timeout or None, model=model,
+                                                 platform=platform)
+        return self.llm_clients[target]
 
-        prompt = self.get_initial_prompt(extracted_text)
-        # prompt = self.get_seed_question_prompt(extracted_text)
-        model = ChatOpenAI(model=self.cfg.model, temperature=0)
-        structured_llm = model.with_structured_output(Quiz, include_raw=True)
+    def get_structured_llm(self, schema=Quiz, target=None):
+        self.stats["llm_requests"] += 1
+        return self.get_llm_client(target).structured_llm(schema)
+
+    def get_rate_limiter(self, target=None):
+        target = target or self.main_target
+        if target not in self.rate_limiters:
+            # --rpm/--tpm describe the main model, other targets learn their limits from headers
+            if target == self.main_target:
+                self.rate_limiters[target] = RateLimiter(self.cfg.rpm, self.cfg.tpm)
+            else:
+                self.rate_limiters[target] = RateLimiter(0, 0)
+        return self.rate_limiters[target]
+
+    def target_name(self, target):
+        platform, model = parse_target(target, self.cfg.platform)
+        return f"{platform}:{model}"
+
+    def pick_target(self, prompt):
+        if self.router is None:
+            return None
+        # an answer any route target gave before is reused, whichever target the router would pick now
+        for target in self.router.targets:
+            if self.llm_cache is not None and self.llm_cache.has(self.llm_cache_key(prompt, self.quiz_schema, target)):
+                return target
+        return self.router.pick(self.request_tokens(prompt))
+
+    def request_tokens(self, prompt):
+        """
+        tokens a request counts against the tokens/minute limit: providers charge the
+        completion too, estimated from the answers so far until usage says otherwise
+        """
+        if self.stats["usage_responses"]:
+            output_tokens = self.stats["output_tokens"] / self.stats["usage_responses"]
+        else:
+            output_tokens = self.default_output_tokens
+        return count_tokens(prompt, self.cfg.model) + int(output_tokens)
+
+    def close_clients(self):
+        for client in self.llm_clients.values():
+            client.close()
+        self.quote_search.close()
+
+    async def aclose_clients(self):
+        for client in self.llm_clients.values():
+            await client.aclose()
+        self.quote_search.close()
+
+    def llm_cache_key(self, prompt, schema=Quiz, target=None):
+        if schema not in self.schema_versions:
+            self.schema_versions[schema] = Manifest.digest(schema.model_json_schema())
+        platform, model = parse_target(target or self.main_target, self.cfg.platform)
+        return Manifest.digest(platform, model, self.temperature, prompt, self.schema_versions[schema])
+
+    def get_cached_res(self, prompt, schema=Quiz, target=None):
+        if self.llm_cache is None:
+            return None
+        value = self.llm_cache.get(self.llm_cache_key(prompt, schema, target))
+        if value is None:
+            return None
+        log.debug("llm cache hit")
+        return {'raw': None, 'parsed': schema.model_validate_json(value), 'parsing_error': None}
+
+    def put_cached_res(self, prompt, res, schema=Quiz, target=None):
+        # only cache answers we could use, a parsing error should be retried next time
+        if self.llm_cache is None or res['parsing_error'] is not None or res['parsed'] is None:
+            return
+        self.llm_cache.put(self.llm_cache_key(prompt, schema, target), res['parsed'].model_dump_json())
+
+    def invoke_llm(self, prompt, schema=Quiz, chapters=(), target=None):
+        res = self.get_cached_res(prompt, schema, target)
+        if res is not None:
+            return res
+        structured_llm = self.get_structured_llm(schema, target)
+        rate_limiter = self.get_rate_limiter(target)
+        num_tokens = self.request_tokens(prompt)
+        rate_limiter.acquire(num_tokens)
+        start = time.perf_counter()
         res = self.get_structured_llm_res(structured_llm, prompt)
+        self.record_latency(target, time.perf_counter() - start)
+        self.record_response(res, chapters, rate_limiter, num_tokens)
+        self.put_cached_res(prompt, res, schema, target)
+        return res
+
+    async def invoke_llm_async(self, prompt, schema=Quiz, chapters=(), target=None):
+        res = self.get_cached_res(prompt, schema, target)
+        if res is not None:
+            return res
+        structured_llm = self.get_structured_llm(schema, target)
+        rate_limiter = self.get_rate_limiter(target)
+        num_tokens = self.request_tokens(prompt)
+        await rate_limiter.acquire_async(num_tokens)
+        start = time.perf_counter()
+        res = await self.hedger.call(lambda: self.get_structured_llm_res_async(structured_llm, prompt),
+                                     self.latency[target or self.main_target], rate_limiter, num_tokens)
+        self.record_latency(target, time.perf_counter() - start)
+        self.record_response(res, chapters, rate_limiter, num_tokens)
+        self.put_cached_res(prompt, res, schema, target)
+        return res
+
+    def record_latency(self, target, seconds):
+        self.stats["llm_seconds"] += seconds
+        self.latency[target or self.main_target].add(seconds)
+
+    def ask_questions_yaml(self, chapter, title, extracted_text):
+
+        parts = self.get_part_prompts(extracted_text)
+        if parts is None:
+            return None
+        # prompt = self.get_seed_question_prompt(extracted_text)
+        results = [self.ask_part(chapter, part, prompt) for part, prompt in parts]
+        return self.res_to_yaml(chapter, title, self.merge_parts(chapter, results))
+
+    async def ask_questions_yaml_async(self, chapter, title, extracted_text):
+        parts = self.get_part_prompts(extracted_text)
+        if parts is None:
+            return None
+        # the parts of a big chapter are independent requests, so they run side by side
+        results = await asyncio.gather(*[self.ask_part_async(chapter, part, prompt) for part, prompt in parts])
+        return self.res_to_yaml(chapter, title, self.merge_parts(chapter, results))
+
+    def ask_part(self, chapter, text, prompt):
+        """
+        with --cascade_model the cheap model answers first, and the main model is only
+        asked when that answer fails validation or quotes text that isn't in the passage
+        """
+        start = time.perf_counter()
+        if self.cfg.cascade_model:
+            res = self.from_wire(self.ask_llm(prompt, chapter, self.cascade_target))
+            res = self.repair_res(chapter, text, res, self.cascade_target)
+            if self.accept_cascade_res(chapter, self.check_res(text, res), start):
+                return res
+        target = self.pick_target(prompt)
+        res = self.from_wire(self.ask_llm(prompt, chapter, target))
+        res = self.repair_res(chapter, text, res, target)
+        self.tier_latency[target or self.main_target].append(time.perf_counter() - start)
+        return res
+
+    async def ask_part_async(self, chapter, text, prompt):
+        start = time.perf_counter()
+        if self.cfg.cascade_model:
+            res = await self.ask_llm_async(prompt, chapter, self.cascade_target)
+            res = await self.repair_res_async(chapter, text, self.from_wire(res), self.cascade_target)
+            # the quote search is cpu bound, off the event loop it doesn't hold up other requests
+            problem = await asyncio.to_thread(self.check_res, text, res)
+            if self.accept_cascade_res(chapter, problem, start):
+                return res
+        target = self.pick_target(prompt)
+        res = self.from_wire(await self.ask_llm_async(prompt, chapter, target))
+        res = await self.repair_res_async(chapter, text, res, target)
+        self.tier_latency[target or self.main_target].append(time.perf_counter() - start)
+        return res
+
+    def ask_llm(self, prompt, chapter, target=None):
+        if self.cfg.stream:
+            return self.invoke_llm_stream(prompt, chapter, target)
+        return self.invoke_llm(prompt, self.quiz_schema, [chapter], target)
+
+    async def ask_llm_async(self, prompt, chapter, target=None):
+        if self.cfg.stream:
+            return await self.invoke_llm_stream_async(prompt, chapter, target)
+        return await self.invoke_llm_async(prompt, self.quiz_schema, [chapter], target)
+
+    def get_streaming_llm(self, target=None):
+        self.stats["llm_requests"] += 1
+        return self.get_llm_client(target).streaming_llm(self.quiz_schema)
+
+    def invoke_llm_stream(self, prompt, chapter, target=None):
+        """
+        like invoke_llm, but the answer is streamed and every item validated as it arrives
+        """
+        res = self.get_cached_res(prompt, self.quiz_schema, target)
+        if res is not None:
+            return res
+        streaming_llm = self.get_streaming_llm(target)
+        rate_limiter = self.get_rate_limiter(target)
+        num_tokens = self.request_tokens(prompt)
+        rate_limiter.acquire(num_tokens)
+        stream = self.item_stream(chapter)
+        message = None
+        chunks = streaming_llm.stream(prompt)
+        try:
+            for chunk in chunks:
+                message = chunk if message is None else message + chunk
+                stream.feed(chunk.content)
+        except StreamAborted:
+            pass
+        finally:
+            # closing the stream drops the connection, so an aborted answer stops generating
+            chunks.close()
+        return self.stream_res(prompt, chapter, target, stream, message, rate_limiter, num_tokens)
+
+    async def invoke_llm_stream_async(self, prompt, chapter, target=None):
+        res = self.get_cached_res(prompt, self.quiz_schema, target)
+        if res is not None:
+            return res
+        streaming_llm = self.get_streaming_llm(target)
+        rate_limiter = self.get_rate_limiter(target)
+        num_tokens = self.request_tokens(prompt)
+        await rate_limiter.acquire_async(num_tokens)
+        stream = self.item_stream(chapter)
+        message = None
+        chunks = streaming_llm.astream(prompt)
+
+        async def consume():
+            nonlocal message
+            async for chunk in chunks:
+                message = chunk if message is None else message + chunk
+                stream.feed(chunk.content)
+
+        try:
+            # the hedger doesn't see streamed requests, so they get its deadline here
+            await asyncio.wait_for(consume(), self.hedger.deadline)
+        except StreamAborted:
+            pass
+        except asyncio.TimeoutError:
+            self.hedger.timeouts += 1
+            raise TimeoutError(f"no complete answer within the {self.hedger.deadline}s request deadline")
+        finally:
+            await chunks.aclose()
+        return self.stream_res(prompt, chapter, target, stream, message, rate_limiter, num_tokens)
+
+    def item_stream(self, chapter):
+        items_key = "i" if self.compact else "items"
+        return ItemStream(self.repair, items_key, on_item=lambda item: self.write_partial_yaml(chapter, item))
+
+    def stream_res(self, prompt, chapter, target, stream, message, rate_limiter, num_tokens=0):
+        self.record_latency(target, time.perf_counter() - stream.started)
+        if message is not None:
+            self.record_response({'raw': message}, [chapter], rate_limiter, num_tokens)
+        if stream.first_item_seconds is not None:
+            self.stats["streams_with_items"] += 1
+            self.stats["first_item_seconds"] += stream.first_item_seconds
+        if stream.error is not None:
+            self.stats["streams_aborted"] += 1
+            log.warning(f"{chapter}: stopped streaming answer after {stream.length} characters: {stream.error}")
+            return {'raw': None, 'parsed': None, 'parsing_error': stream.error}
+        res = {'raw': message, 'parsed': None, 'parsing_error': None}
+        try:
+            res['parsed'] = self.quiz_schema.model_validate_json(stream.text())
+        except ValidationError as e:
+            res['parsing_error'] = e
+        self.put_cached_res(prompt, res, self.quiz_schema, target)
+        return res
+
+    def write_partial_yaml(self, chapter, item):
+        """
+        rewrite the chapter yaml with the items streamed so far every partial_yaml_items, so later
+        stages can start on them
+        """
+        partial = self.partial.get(chapter)
+        if partial is None:
+            return
+        partial["items"].append(item)
+        # every rewrite serializes all the items so far, the complete answer is written at the end anyway
+        if len(partial["items"]) % self.partial_yaml_items:
+            return
+        res = {'raw': None, 'parsed': Quiz(questions=Questions(items=partial["items"])), 'parsing_error': None}
+        yaml_txt = self.res_to_yaml(chapter, partial["title"], res)
+        yaml_file_name = f"{self.cfg.output_dir_yaml}/{chapter}.yaml"
+        Utils.write_file_atomic(yaml_file_name, f"# {chapter} : {partial['title']} (in progress)\n{yaml_txt}\n")
+
+    def accept_cascade_res(self, chapter, problem, start):
+        if problem is None:
+            self.stats["cascade_accepted"] += 1
+            self.tier_latency[self.cascade_target].append(time.perf_counter() - start)
+            return True
+        log.info(f"{chapter}: escalating to {self.cfg.model}, {self.cfg.cascade_model} answer {problem}")
+        if chapter in self.partial:
+            self.partial[chapter]["items"] = []
+        self.stats["cascade_escalated"] += 1
+        return False
+
+    def check_res(self, text, res):
+        """
+        None when the answer is usable, otherwise what is wrong with it. the Quiz
+        validators already ran while parsing, so this adds the quote check.
+        """
+        if res['parsing_error'] is not None or res['parsed'] is None:
+            return "failed validation"
+        items = res['parsed'].questions.items
+        if not items:
+            return "has no questions"
+        quotes = [quote for item in items for quote in item.quotes]
+        try:
+            # a window of similar words isn't the quote, only matches within the edit budget count
+            locations = self.quote_search.locate_quotes("check", text, quotes, strict=True)
+        except ValueError:
+            locations = [(None, None, None)] * len(quotes)
+        for quote, (beg_loc, end_loc, num_err) in zip(quotes, locations):
+            if beg_loc is None:
+                return f"quotes text not in the passage: {quote}"
+        return None
+
+    def merge_parts(self, chapter, results):
+        """
+        one Quiz from the answers for each part of a split chapter. a failed part fails the
+        whole chapter, the good parts are in the llm cache so the retry only pays for it.
+        """
+        if len(results) == 1:
+            return results[0]
+        self.stats["split_chapters"] += 1
+        self.stats["split_parts"] += len(results)
+        for num, res in enumerate(results):
+            if res['parsing_error'] is not None or res['parsed'] is None:
+                log.error(f"{chapter}: part {num + 1} of {len(results)} failed")
+                return res
+        items = [item for res in results for item in res['parsed'].questions.items]
+        return {'raw': None, 'parsed': Quiz(questions=Questions(items=items)), 'parsing_error': None}
+
+    def repair_res(self, chapter, text, res, target=None):
+        """
+        on a parsing error keep the valid items and ask again only for the rejected ones
+        """
+        slots, failed = self.salvage_res(res)
+        if slots is None:
+            return res
+        num_failed = len(failed)
+        for _ in range(self.cfg.repair_attempts):
+            prompt = self.get_repair_prompt(chapter, text, slots, failed)
+            if prompt is None:
+                break
+            repair = self.invoke_llm(prompt, self.quiz_schema, [chapter], target)
+            failed = self.repair.apply_repair(slots, failed, repair)
+        return self.repaired_res(chapter, res, slots, num_failed, failed)
+
+    async def repair_res_async(self, chapter, text, res, target=None):
+        slots, failed = self.salvage_res(res)
+        if slots is None:
+            return res
+        num_failed = len(failed)
+        for _ in range(self.cfg.repair_attempts):
+            prompt = self.get_repair_prompt(chapter, text, slots, failed)
+            if prompt is None:
+                break
+            repair = await self.invoke_llm_async(prompt, self.quiz_schema, [chapter], target)
+            failed = self.repair.apply_repair(slots, failed, repair)
+        return self.repaired_res(chapter, res, slots, num_failed, failed)
+
+    def salvage_res(self, res):
+        """
+        (slots, failed) of an answer worth repairing, (None, None) otherwise
+        """
         if res['parsing_error'] is None:
-            if False:
-                prompt += f"Your response was {res}"
-                prompt += self.get_additional_seed_prompt(extracted_text, res)
-                res = self.get_structured_llm_res(structured_llm, prompt)
+            return None, None
+        return self.repair.salvage(res)
 
+    def get_repair_prompt(self, chapter, text, slots, failed):
+        """
+        the prompt for the next repair request, or None once nothing is left to repair
+        """
+        if not failed:
+            return None
+        log.info(f"{chapter}: repairing {len(failed)} of {len(slots)} items")
+        self.stats["repair_requests"] += 1
+        return self.repair.get_repair_prompt(self.prompt_prefix, text, failed)
+
+    def repaired_res(self, chapter, res, slots, num_failed, failed):
+        for slot, raw_item, error in failed:
+            log.warning(f"{chapter}: dropping item {slot} after repair: {error}")
+        self.stats["items_kept"] += len(slots) - num_failed
+        self.stats["items_repaired"] += num_failed - len(failed)
+        self.stats["items_dropped"] += len(failed)
+        return self.repair.merged_res(res, slots)
+
+    def from_wire(self, res, expand=wire_to_quiz):
+        """
+        expand a compact wire answer into the Quiz models, validation errors become a parsing_error
+        """
+        if not self.compact or res['parsing_error'] is not None or res['parsed'] is None:
+            return res
+        try:
+            parsed = expand(res['parsed'])
+        except ValidationError as e:
+            return {'raw': res['raw'], 'parsed': None, 'parsing_error': e}
+        return {'raw': res['raw'], 'parsed': parsed, 'parsing_error': None}
+
+    def record_response(self, res, chapters=(), rate_limiter=None, reserved=0):
+        """
+        feed rate limit headers back to the limiter and sum up token usage, including how
+        much of the prompt the provider served from its prefix cache. the tokens are also
+        charged to the journal entries of the chapters the request was for, and the
+        limiter is settled for the difference to the reserved estimate.
+        """
+        raw = res.get('raw')
+        metadata = getattr(raw, 'response_metadata', None) or {}
+        rate_limiter = rate_limiter or self.get_rate_limiter()
+        rate_limiter.update_from_headers(metadata.get('headers'))
+
+        usage = getattr(raw, 'usage_metadata', None) or {}
+        prompt_tokens = usage.get('input_tokens', 0)
+        cached_tokens = (usage.get('input_token_details') or {}).get('cache_read', 0)
+        if not usage:
+            token_usage = metadata.get('token_usage') or {}
+            prompt_tokens = token_usage.get('prompt_tokens', 0)
+            cached_tokens = (token_usage.get('prompt_tokens_details') or {}).get('cached_tokens', 0)
+        cached_tokens = cached_tokens or 0
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["cached_tokens"] += cached_tokens
+        output_tokens = usage.get('output_tokens', 0)
+        self.stats["output_tokens"] += output_tokens
+        if output_tokens:
+            self.stats["usage_responses"] += 1
+            if reserved:
+                rate_limiter.settle(reserved, prompt_tokens + output_tokens)
+        for chapter in chapters:
+            self.journal.add_tokens(chapter, (prompt_tokens + usage.get('output_tokens', 0)) // len(chapters))
+        log.debug(f"prompt tokens {prompt_tokens}, cached {cached_tokens}")
+
+    def res_to_yaml(self, chapter, title, res):
+        if res['parsing_error'] is None:
             out_parsed = self.remove_optional_nulls(res['parsed'])
             yaml_str = yaml.dump(out_parsed, sort_keys=False)
             out_from_yaml = parse_yaml_raw_as(Quiz, yaml_str)
@@ -226,25 +790,346 @@ please try generating questions again with correct quote markers
 
     def process_csv(self):
         lines = Utils.read_toc_csv(self.cfg.input_file_csv)
+        start_time = time.perf_counter()
+        if self.cfg.llm_mode == "batch":
+            self.process_csv_batch(lines, OpenAIBatchService())
+        elif self.cfg.pack_tokens > 0:
+            self.process_csv_packed(lines)
+        elif self.cfg.concurrency > 1:
+            asyncio.run(self.process_csv_async(lines))
+        else:
+            for start_page, end_page, chapter, title in lines:
+                self.convert(chapter, title)
+        self.stats["elapsed"] = time.perf_counter() - start_time
+        self.close_clients()
+        self.print_summary_table()
+
+    async def process_csv_async(self, lines):
+        """
+        run up to cfg.concurrency chapter requests at once, the llm calls are almost all network wait
+        """
+        semaphore = asyncio.Semaphore(self.cfg.concurrency)
+
+        async def bounded_convert(chapter, title):
+            async with semaphore:
+                await self.convert_async(chapter, title)
+
+        tasks = [bounded_convert(chapter, title) for start_page, end_page, chapter, title in lines]
+        await asyncio.gather(*tasks)
+        await self.aclose_clients()
+
+    def process_csv_batch(self, lines, service):
+        """
+        send every chapter that isn't up to date or cached as one batch job, then write the
+        results through the same yaml path as interactive requests
+        """
+        pending = {}
+        prompts = {}
         for start_page, end_page, chapter, title in lines:
-            self.convert(chapter, title)
+            extracted_text, inputs = self.read_chapter(chapter, title)
+            if extracted_text is None:
+                continue
+            parts = self.get_part_prompts(extracted_text)
+            if parts is None:
+                continue
+            part_ids = [chapter] if len(parts) == 1 else [f"{chapter}.part{num}" for num in range(len(parts))]
+            cached = {}
+            for part_id, (part, prompt) in zip(part_ids, parts):
+                res = self.get_cached_res(prompt, self.quiz_schema)
+                if res is None:
+                    prompts[part_id] = prompt
+                else:
+                    cached[part_id] = res
+            if len(cached) == len(parts):
+                results = [self.from_wire(cached[part_id]) for part_id in part_ids]
+                self.write_yaml(chapter, title, inputs,
+                                self.res_to_yaml(chapter, title, self.merge_parts(chapter, results)))
+                continue
+            pending[chapter] = (title, inputs, parts, part_ids, cached)
+            self.journal.start(chapter)
 
-    def convert(self, chapter, title):
+        runner = BatchRunner(self.cfg, service, f"{self.cfg.output_dir_cache}/batch",
+                             temperature=self.temperature, poll_seconds=self.cfg.batch_poll_seconds,
+                             schema=self.quiz_schema)
+        results = runner.run(prompts)
+        for chapter, (title, inputs, parts, part_ids, cached) in pending.items():
+            if not all(part_id in cached or part_id in results for part_id in part_ids):
+                self.write_yaml(chapter, title, inputs, None, "no result in batch output")
+                continue
+            part_results = []
+            for part_id, (part, prompt) in zip(part_ids, parts):
+                res = cached.get(part_id)
+                if res is None:
+                    res = results[part_id]
+                    self.put_cached_res(prompt, res, self.quiz_schema)
+                part_results.append(self.repair_res(chapter, part, self.from_wire(res)))
+            res = self.merge_parts(chapter, part_results)
+            self.write_yaml(chapter, title, inputs, self.res_to_yaml(chapter, title, res))
+
+    def process_csv_packed(self, lines):
+        """
+        like process_csv, but adjacent small sections share one request
+        """
+        chapters = []
+        for start_page, end_page, chapter, title in lines:
+            extracted_text, inputs = self.read_chapter(chapter, title)
+            if extracted_text is not None and self.get_num_questions(extracted_text) is not None:
+                chapters.append((chapter, title, extracted_text, inputs))
+        groups = self.pack_chapters(chapters)
+        log.info(f"packed {len(chapters)} chapters into {len(groups)} requests")
+
+        if self.cfg.concurrency > 1:
+            asyncio.run(self.generate_groups_async(groups))
+        else:
+            for group in groups:
+                self.generate_group(group)
+
+    def generate_group(self, group):
+        if len(group) == 1:
+            self.generate(*group[0])
+            return
+        self.stats["pack_requests"] += 1
+        chapters = [chapter[0] for chapter in group]
+        for chapter in chapters:
+            self.journal.start(chapter)
+        res = self.invoke_llm(self.get_pack_prompt(group), self.pack_schema, chapters)
+        res = self.from_wire(res, wire_to_pack)
+        for (chapter, title, text, inputs), chapter_res in zip(group, self.split_pack_res(group, res)):
+            if chapter_res is None:
+                log.warning(f"{chapter}: missing from packed answer, asking for it on its own")
+                self.generate(chapter, title, text, inputs, started=True)
+            else:
+                self.stats["packed"] += 1
+                self.write_yaml(chapter, title, inputs, self.res_to_yaml(chapter, title, chapter_res))
+
+    async def generate_group_async(self, group):
+        if len(group) == 1:
+            await self.generate_async(*group[0])
+            return
+        self.stats["pack_requests"] += 1
+        chapters = [chapter[0] for chapter in group]
+        for chapter in chapters:
+            self.journal.start(chapter)
+        try:
+            res = await self.invoke_llm_async(self.get_pack_prompt(group), self.pack_schema, chapters)
+            res = self.from_wire(res, wire_to_pack)
+        except Exception as e:
+            log.error(f"packed request for {chapters} failed: {e}")
+            res = {'raw': None, 'parsed': None, 'parsing_error': e}
+        for (chapter, title, text, inputs), chapter_res in zip(group, self.split_pack_res(group, res)):
+            if chapter_res is None:
+                log.warning(f"{chapter}: missing from packed answer, asking for it on its own")
+                await self.generate_async(chapter, title, text, inputs, started=True)
+            else:
+                self.stats["packed"] += 1
+                self.write_yaml(chapter, title, inputs, self.res_to_yaml(chapter, title, chapter_res))
+
+    async def generate_groups_async(self, groups):
+        semaphore = asyncio.Semaphore(self.cfg.concurrency)
+
+        async def bounded_generate(group):
+            async with semaphore:
+                await self.generate_group_async(group)
+
+        await asyncio.gather(*[bounded_generate(group) for group in groups])
+        await self.aclose_clients()
+
+    def read_chapter(self, chapter, title):
+        """
+        returns the chapter text and manifest inputs, or None when the yaml is up to date
+        """
         txt_file_name = f"{self.cfg.output_dir_txt}/{chapter}.txt"
         yaml_file_name = f"{self.cfg.output_dir_yaml}/{chapter}.yaml"
 
         # TODO: check txt_file_name exists
         with open(txt_file_name, 'r', encoding='utf-8') as file:
             extracted_text = file.read()
+        compacted_text = extracted_text
+        if not self.cfg.no_compact_text:
+            compacted_text = self.search.compact_text(extracted_text)
+
+        inputs = self.chapter_inputs(title, compacted_text)
+        if self.manifest.is_fresh(chapter, inputs, [yaml_file_name]):
+            self.stats["skipped"] += 1
+            return None, None
+        inputs_digest = Manifest.digest(inputs)
+        if self.journal.should_skip(chapter, inputs_digest):
+            self.stats["skipped"] += 1
+            return None, None
+        self.journal.queue(chapter, inputs_digest)
+        if not self.cfg.no_compact_text:
+            # only chapters that are sent count, skipped ones don't spend any tokens
+            self.count_compaction(chapter, extracted_text, compacted_text)
+        return compacted_text, inputs
+
+    def count_compaction(self, chapter, text, compacted):
+        """
+        log and add up the prompt tokens saved by stripping pdf extraction artifacts
+        """
+        before = count_tokens(text, self.cfg.model)
+        after = count_tokens(compacted, self.cfg.model)
+        if before:
+            saved_pct = 100 * (before - after) / before
+            log.info(f"{chapter}: compacted text from {before} to {after} tokens ({saved_pct:.0f}% less)")
+        self.stats["text_tokens"] += before
+        self.stats["compacted_tokens"] += after
+
+    def write_yaml(self, chapter, title, inputs, yaml_txt, error=None):
+        yaml_file_name = f"{self.cfg.output_dir_yaml}/{chapter}.yaml"
+        partial = self.partial.pop(chapter, None)
+        if not yaml_txt:
+            self.stats["failed"] += 1
+            self.journal.finish(chapter, error or "no valid questions in answer")
+            if partial and partial["items"] and os.path.exists(yaml_file_name):
+                # don't leave a half streamed chapter behind
+                os.remove(yaml_file_name)
+            return
+        # TODO: process yaml to add additional tags
+        Utils.write_file_atomic(yaml_file_name, f"# {chapter} : {title}\n{yaml_txt}\n")
+        log.info(f'Saved {chapter} to {yaml_file_name}')
+        self.manifest.record(chapter, inputs)
+        self.journal.finish(chapter)
+        self.stats["generated"] += 1
+
+    def convert(self, chapter, title):
+        extracted_text, inputs = self.read_chapter(chapter, title)
+        if extracted_text is None:
+            return
+        self.generate(chapter, title, extracted_text, inputs)
+
+    def generate(self, chapter, title, extracted_text, inputs, started=False):
+        # a chapter missing from a packed answer was already started in the journal with its group
+        if not started:
+            self.journal.start(chapter)
+        if self.cfg.stream:
+            self.partial[chapter] = {"title": title, "items": []}
+        yaml_txt = self.ask_questions_yaml(chapter, title, extracted_text)
+        self.write_yaml(chapter, title, inputs, yaml_txt)
 
-            yaml_txt = self.ask_questions_yaml(chapter, title, extracted_text)
-            if yaml_txt:
-                with open(yaml_file_name, 'w', encoding='utf-8') as file:
-                    file.write(f"# {chapter} : {title}\n")
-                    # TODO: process yaml to add additional tags
-                    file.write(yaml_txt)
-                    file.write("\n")
-                    log.info(f'Saved {chapter} to {yaml_file_name}')
+    async def convert_async(self, chapter, title):
+        extracted_text, inputs = self.read_chapter(chapter, title)
+        if extracted_text is None:
+            return
+        await self.generate_async(chapter, title, extracted_text, inputs)
+
+    async def generate_async(self, chapter, title, extracted_text, inputs, started=False):
+        if not started:
+            self.journal.start(chapter)
+        if self.cfg.stream:
+            self.partial[chapter] = {"title": title, "items": []}
+        error = None
+        try:
+            yaml_txt = await self.ask_questions_yaml_async(chapter, title, extracted_text)
+        except Exception as e:
+            # one failed chapter shouldn't cancel the rest of the batch
+            log.error(f"{chapter}: request failed: {e}")
+            yaml_txt = None
+            error = e
+        self.write_yaml(chapter, title, inputs, yaml_txt, error)
+
+    def print_summary_table(self):
+        table = PrettyTable()
+        table.field_names = ["Stat", "Value"]
+        table.align["Stat"] = "l"
+        table.align["Value"] = "r"
+        elapsed = self.stats["elapsed"]
+        table.add_row(["chapters generated", self.stats["generated"]])
+        table.add_row(["chapters failed", self.stats["failed"]])
+        table.add_row(["chapters skipped", self.stats["skipped"]])
+        counts = self.journal.counts()
+        journal = f"{counts['done']}/{counts['failed']}/{counts['pending'] + counts['in-flight']}"
+        table.add_row(["journal done/failed/pending", journal])
+        table.add_row(["concurrency", self.cfg.concurrency])
+        table.add_row(["elapsed (s)", f"{elapsed:.1f}"])
+        waited = sum(rate_limiter.waited for rate_limiter in self.rate_limiters.values())
+        table.add_row(["rate limit wait (s)", f"{waited:.1f}"])
+        if self.llm_clients:
+            # before pooling, every request paid for building the client and schema wrapper
+            setup = sum(client.setup_seconds for client in self.llm_clients.values())
+            saved = setup / len(self.llm_clients) * (self.stats["llm_requests"] - len(self.llm_clients))
+            table.add_row(["client setup (s)", f"{setup:.3f}"])
+            table.add_row(["setup saved (s)", f"{saved:.3f}"])
+        tiers = self.quote_search.tier_counts
+        if sum(tiers.values()):
+            table.add_row(["quote check cached/exact/fuzzy/window/missing",
+                           f"{tiers['cached']}/{tiers['exact']}/{tiers['fuzzy']}/{tiers['window']}/{tiers['missing']}"])
+        if self.stats["text_tokens"]:
+            saved = self.stats["text_tokens"] - self.stats["compacted_tokens"]
+            saved_pct = 100 * saved / self.stats["text_tokens"]
+            table.add_row(["passage tokens saved by compaction", f"{int(saved)} ({saved_pct:.0f}%)"])
+        if self.stats["prompt_tokens"]:
+            cached_pct = 100 * self.stats["cached_tokens"] / self.stats["prompt_tokens"]
+            table.add_row(["prompt tokens", int(self.stats["prompt_tokens"])])
+            table.add_row(["cached prompt tokens", f"{int(self.stats['cached_tokens'])} ({cached_pct:.0f}%)"])
+            table.add_row(["output tokens", int(self.stats["output_tokens"])])
+        if self.stats["llm_requests"]:
+            mean_latency = self.stats["llm_seconds"] / self.stats["llm_requests"]
+            table.add_row(["mean request latency (s)", f"{mean_latency:.1f}"])
+        if self.cfg.concurrency > 1:
+            table.add_row(["requests over deadline", self.hedger.timeouts])
+        if self.cfg.stream:
+            table.add_row(["streams aborted early", self.stats["streams_aborted"]])
+            if self.stats["streams_with_items"]:
+                first_item = self.stats["first_item_seconds"] / self.stats["streams_with_items"]
+                table.add_row(["mean time to first item (s)", f"{first_item:.1f}"])
+        if self.cfg.hedge:
+            table.add_row(["hedges issued", self.hedger.issued])
+            table.add_row(["hedges won", self.hedger.won])
+        if self.cfg.cascade_model:
+            tried = self.stats["cascade_accepted"] + self.stats["cascade_escalated"]
+            rate = 100 * self.stats["cascade_escalated"] / tried if tried else 0
+            table.add_row(["escalated to main model", f"{int(self.stats['cascade_escalated'])} ({rate:.0f}%)"])
+            # chapter latency per tier, the escalated tier includes the time spent on the cheap model
+            for target, latencies in self.tier_latency.items():
+                table.add_row([f"p50 latency {target} (s)", f"{statistics.median(latencies):.1f}"])
+        if self.stats["split_chapters"]:
+            table.add_row(["chapters split", self.stats["split_chapters"]])
+            table.add_row(["requests for split chapters", self.stats["split_parts"]])
+        if self.cfg.pack_tokens > 0:
+            table.add_row(["packed requests", self.stats["pack_requests"]])
+            table.add_row(["chapters from packed requests", self.stats["packed"]])
+        if self.stats["repair_requests"] or self.stats["items_dropped"]:
+            table.add_row(["repair requests", self.stats["repair_requests"]])
+            table.add_row(["items kept from rejected answers", self.stats["items_kept"]])
+            table.add_row(["items repaired", self.stats["items_repaired"]])
+            table.add_row(["items dropped", self.stats["items_dropped"]])
+        if self.llm_cache is not None:
+            table.add_row(["llm cache hits", self.llm_cache.hits])
+            table.add_row(["llm cache misses", self.llm_cache.misses])
+        if elapsed > 0:
+            chapters_per_min = 60 * (self.stats["generated"] + self.stats["failed"]) / elapsed
+            table.add_row(["chapters/min", f"{chapters_per_min:.1f}"])
+        log.info(table)
+        if any(histogram.recent for histogram in self.latency.values()):
+            self.print_latency_table()
+
+    def print_latency_table(self):
+        """
+        request latency histogram of every provider/model used in the run
+        """
+        table = PrettyTable()
+        table.field_names = ["Target", "Requests", "p50 (s)", "p95 (s)"] + LatencyHistogram.labels()
+        table.align["Target"] = "l"
+        for target, histogram in sorted(self.latency.items()):
+            if not histogram.recent:
+                continue
+            table.add_row([target, sum(histogram.counts), f"{histogram.percentile(50):.1f}",
+                           f"{histogram.percentile(95):.1f}"] + histogram.counts)
+        log.info(table)
+
+    def chapter_inputs(self, title, extracted_text):
+        """
+        everything that changes the generated yaml: the prompt (which embeds the text) and the model
+        """
+        parts = self.get_part_prompts(extracted_text)
+        prompts = [prompt for part, prompt in parts] if parts else [extracted_text]
+        inputs = {"prompt": Manifest.digest(*prompts), "title": title,
+                  "platform": self.cfg.platform, "model": self.cfg.model}
+        if self.cfg.cascade_model:
+            inputs["cascade_model"] = self.cfg.cascade_model
+        if self.cfg.route:
+            inputs["route"] = self.cfg.route
+        return inputs
 
     def check_files(self):
         try:
@@ -5,9 +5,10 @@
 import os
 import logging
 import csv
+import hashlib
 from pydantic import Field
 from pydantic_settings import BaseSettings
-from typing import Literal
+from typing import List, Literal
 from colorama import Fore, Style
 
 log = logging.getLogger()
@@ -20,6 +21,31 @@ class Config(BaseSettings):
     # vars
     num_words_per_question: int = Field(default=250, alias='num_words')
     no_feedback_images: bool = False
+    page_cache: bool = False
+    jobs: int = 1
+    pdf_backend: str = "pypdf"
+    force: bool = False
+    concurrency: int = 1
+    rpm: int = 0
+    tpm: int = 0
+    no_llm_cache: bool = False
+    llm_cache_mb: int = 512
+    llm_mode: Literal["interactive", "batch"] = "interactive"
+    batch_poll_seconds: int = 60
+    pack_tokens: int = 0
+    max_section_tokens: int = 0
+    wire_schema: Literal["full", "compact"] = "full"
+    repair_attempts: int = 1
+    cascade_model: str = ""
+    route: List[str] = []
+    request_timeout: float = 300
+    hedge: bool = False
+    hedge_budget: float = 0.05
+    stream: bool = False
+    no_compact_text: bool = False
+    match_backend: Literal["myers", "regex"] = "myers"
+    no_quote_cache: bool = False
+    retry_failed: bool = False
     # paths
 
     # File paths
@@ -34,6 +60,9 @@ class Config(BaseSettings):
     output_dir_png: str = "outputs/png"
     output_dir_pdf: str = "outputs/pdf"
     output_dir_zip: str = "outputs/zip"
+    output_dir_cache: str = "outputs/cache"
+    manifest_file: str = "outputs/.manifest.json"
+    journal_file: str = "outputs/.journal.json"
 
     platform: str = Field(default="openai")
     model: str = Field(default="undefined")
@@ -178,6 +207,28 @@ class Utils():
             log.warn(f"No {suffix} files found in {dirname}")
             return False
 
+    @staticmethod
+    def write_file_atomic(filename, content):
+        """
+        write to a temp file next to filename and rename it into place, so readers
+        never see a half written file even if the process dies mid-write
+        """
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
+            file.write(content)
+        os.replace(tmp_filename, filename)
+
+    @staticmethod
+    def hash_file(filename, chunk_size=1 << 20):
+        """
+        sha256 hex digest of a file, read in chunks so large pdfs are not loaded at once
+        """
+        sha = hashlib.sha256()
+        with open(filename, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
     @staticmethod
     def read_toc_csv(filename):
         """
@@ -8,6 +8,7 @@ import logging
 from pathlib import Path
 from .CanvasInterface import upload_canvas_quiz, upload_canvas_zipfiles
 from .Utils import Utils
+from .Manifest import Manifest
 
 log = logging.getLogger()
 
@@ -15,14 +16,31 @@ log = logging.getLogger()
 class Xml2Quiz:
     def __init__(self, cfg):
         self.cfg = cfg
+        self.manifest = Manifest(cfg, "xml_to_quiz")
 
     def process_qti_and_images(self):
         lines = Utils.read_toc_csv(self.cfg.input_file_csv)
 
+        # only upload chapters whose xml or images changed since the last upload
+        inputs = {}
+        changed = []
+        for start_page, end_page, chapter, title in lines:
+            xml_filename = str(Path(self.cfg.output_dir_xml, f"{chapter}.xml"))
+            if not os.path.isfile(xml_filename):
+                log.error(f" ERROR: qti file missing {xml_filename}")
+                continue
+            inputs[chapter] = self.chapter_inputs(chapter, xml_filename)
+            if not self.manifest.is_fresh(chapter, inputs[chapter]):
+                changed.append(chapter)
+
+        if not changed:
+            log.info("all chapters are already uploaded")
+            return
+
         if not self.cfg.no_feedback_images:
             # create separate zip files for each chapter
             files_to_upload = []
-            for start_page, end_page, chapter, title in lines:
+            for chapter in changed:
                 png_dirname = str(Path(self.cfg.output_dir_png, chapter))
                 if os.path.isdir(png_dirname):
                     png_zipfile = str(Path(self.cfg.output_dir_zip, f"{chapter}_png.zip"))
@@ -33,19 +51,25 @@ class Xml2Quiz:
             for file in files_to_upload:
                 upload_canvas_zipfiles(file)
 
-        files_to_upload = []
-        for start_page, end_page, chapter, title in lines:
-            xml_filename = str(Path(self.cfg.output_dir_xml, f"{chapter}.xml"))
-            if os.path.isfile(xml_filename):
-                files_to_upload.append(xml_filename)
-            else:
-                log.error(f" ERROR: qti file missing {xml_filename}")
-
-        if files_to_upload:
-            qti_file_path = str(Path(self.cfg.output_dir_zip, "xml.zip"))
-            parent_dir = os.path.dirname(self.cfg.output_dir_xml)
-            self.zip_files(parent_dir, files_to_upload, qti_file_path)
-            upload_canvas_quiz(qti_file_path)
+        files_to_upload = [str(Path(self.cfg.output_dir_xml, f"{chapter}.xml")) for chapter in changed]
+        qti_file_path = str(Path(self.cfg.output_dir_zip, "xml.zip"))
+        parent_dir = os.path.dirname(self.cfg.output_dir_xml)
+        self.zip_files(parent_dir, files_to_upload, qti_file_path)
+        upload_canvas_quiz(qti_file_path)
+
+        for chapter in changed:
+            self.manifest.record(chapter, inputs[chapter])
+
+    def chapter_inputs(self, chapter, xml_filename):
+        png_hashes = []
+        png_dirname = str(Path(self.cfg.output_dir_png, chapter))
+        if not self.cfg.no_feedback_images and os.path.isdir(png_dirname):
+            for root, dirs, files in os.walk(png_dirname):
+                for file in sorted(files):
+                    file_path = os.path.join(root, file)
+                    png_hashes.append([os.path.relpath(file_path, png_dirname), Utils.hash_file(file_path)])
+        return {"xml": Utils.hash_file(xml_filename), "png": sorted(png_hashes),
+                "no_feedback_images": self.cfg.no_feedback_images}
 
     # Zip the xml files
     def zip_files(self, parent, file_paths, output_filename):
@@ -2,11 +2,17 @@
 #
 #
 
+import os
+import re
 import sys
 import logging
+from collections import Counter, defaultdict
+
+from prettytable import PrettyTable
 
 from .Utils import Utils
 from .Qti import Qti
+from .Manifest import Manifest
 
 log = logging.getLogger()
 
@@ -14,15 +20,25 @@ log = logging.getLogger()
 class Yaml2Xml:
     def __init__(self, cfg):
         self.cfg = cfg
+        self.manifest = Manifest(cfg, "yaml_to_xml")
+        self.pdf_hash = None
+        self.tier_counts = Counter()
+        self.tier_seconds = defaultdict(float)
 
     def convert_yaml_to_xml(self, start_page, end_page, chapter, yaml_content):
         qti = Qti(self.cfg, start_page, end_page, chapter, yaml_content)
         qti.generate_feedback_images()
+        search = qti.image_gen.search
+        self.tier_counts.update(search.tier_counts)
+        for tier, seconds in search.tier_seconds.items():
+            self.tier_seconds[tier] += seconds
+        search.close()
         xml_content = qti.to_xml()
         return xml_content
 
     def process_yaml(self):
         lines = Utils.read_toc_csv(self.cfg.input_file_csv)
+        self.pdf_hash = Utils.hash_file(self.cfg.input_file_pdf)
         for line in lines:
             self.convert(line)
 
@@ -35,12 +51,37 @@ class Yaml2Xml:
         # TODO: check yaml_file_name exists
         with open(yaml_file_name, 'r', encoding='utf-8') as file:
             yaml_content = file.read()
+            inputs = self.chapter_inputs(line, yaml_content)
+            if self.manifest.is_fresh(chapter, inputs, self.chapter_outputs(xml_file_name)):
+                return
             xml_content = self.convert_yaml_to_xml(start_page, end_page, chapter, yaml_content)
             if xml_content:
                 with open(xml_file_name, 'w', encoding='utf-8') as file:
                     file.write(xml_content)
                     file.write(f"\n<!-- {chapter} {title} -->\n")
                     log.info(f'Saved {chapter} to {xml_file_name}')
+                self.manifest.record(chapter, inputs)
+
+    def chapter_outputs(self, xml_file_name):
+        """
+        the xml and, with feedback images, every png it links to, so deleted images get rebuilt
+        """
+        outputs = [xml_file_name]
+        if self.cfg.no_feedback_images or not os.path.exists(xml_file_name):
+            return outputs
+        with open(xml_file_name, 'r', encoding='utf-8') as file:
+            imgnames = re.findall(r'Uploaded Media/png/([^"<&\s]+\.png)', file.read())
+        outputs.extend(f"{self.cfg.output_dir_png}/{imgname}" for imgname in sorted(set(imgnames)))
+        return outputs
+
+    def chapter_inputs(self, line, yaml_content):
+        """
+        the xml depends on the questions, and the feedback images on the pdf pages
+        """
+        start_page, end_page, chapter, title = line
+        return {"yaml": Manifest.digest(yaml_content), "title": title,
+                "pdf": self.pdf_hash, "pages": [start_page, end_page],
+                "no_feedback_images": self.cfg.no_feedback_images}
 
     def check_files(self):
         try:
@@ -61,10 +102,26 @@ class Yaml2Xml:
             log.error(f"Error: {e}")
             sys.exit(1)
 
+    def print_tier_table(self):
+        """
+        how many quotes each search tier resolved, and the time it took
+        """
+        total = sum(self.tier_counts.values())
+        if not total:
+            return
+        table = PrettyTable()
+        table.field_names = ["Quote search tier", "Quotes", "Fraction", "Time (s)"]
+        table.align["Quote search tier"] = "l"
+        for tier in ("cached", "exact", "fuzzy", "window", "missing"):
+            table.add_row([tier, self.tier_counts[tier], f"{100 * self.tier_counts[tier] / total:.0f}%",
+                           f"{self.tier_seconds[tier]:.2f}"])
+        log.info(table)
+
     def run(self):
         Utils.setup_logging()
         self.check_files()
         self.process_yaml()
+        self.print_tier_table()
 
 
 def yaml_to_xml(cfg):
@@ -0,0 +1,48 @@
+"""Offline tests of the batch submission flow using the local batch service."""
+from __future__ import annotations
+
+import json
+
+from pydantic_yaml import parse_yaml_raw_as
+
+from doc2quiz.BatchRunner import BatchRunner, LocalBatchService
+from doc2quiz.ExampleYaml import example_yaml
+from doc2quiz.Quiz import Quiz
+from doc2quiz.Utils import Config
+
+
+def example_quiz_json(body):
+    return parse_yaml_raw_as(Quiz, example_yaml).model_dump_json()
+
+
+def test_batch_round_trip(tmp_path):
+    cfg = Config(model="gpt-4o-mini")
+    seen = []
+
+    def responder(body):
+        seen.append(body)
+        return example_quiz_json(body)
+
+    runner = BatchRunner(cfg, LocalBatchService(responder), str(tmp_path), poll_seconds=0)
+    results = runner.run({"ch7p1": "first passage", "ch7p2": "second passage"})
+
+    assert set(results) == {"ch7p1", "ch7p2"}
+    for res in results.values():
+        assert res["parsing_error"] is None
+        assert isinstance(res["parsed"], Quiz)
+    assert [body["messages"][0]["content"] for body in seen] == ["first passage", "second passage"]
+    assert all(body["model"] == "gpt-4o-mini" for body in seen)
+
+    batch_files = [path for path in tmp_path.iterdir() if not path.name.endswith("-output.jsonl")]
+    assert len(batch_files) == 1
+    request = json.loads(batch_files[0].read_text().splitlines()[0])
+    assert request["custom_id"] == "ch7p1"
+    assert request["url"] == "/v1/chat/completions"
+
+
+def test_batch_invalid_output(tmp_path):
+    cfg = Config(model="gpt-4o-mini")
+    runner = BatchRunner(cfg, LocalBatchService(lambda body: '{"questions": {}}'), str(tmp_path), poll_seconds=0)
+    results = runner.run({"ch7p1": "passage"})
+    assert results["ch7p1"]["parsed"] is None
+    assert results["ch7p1"]["parsing_error"] is not None
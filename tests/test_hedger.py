@@ -0,0 +1,93 @@
+"""Tests of request deadlines and hedged duplicates."""
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from doc2quiz.Hedger import Hedger
+from doc2quiz.RateLimiter import RateLimiter
+from doc2quiz.Router import LatencyHistogram
+
+
+def fast_history():
+    histogram = LatencyHistogram()
+    for _ in range(Hedger.min_samples):
+        histogram.add(0.01)
+    return histogram
+
+
+class Calls:
+    """
+    make_call for the hedger: each call sleeps for the next of latencies and
+    records whether it finished or was cancelled
+    """
+    def __init__(self, *latencies):
+        self.latencies = list(latencies)
+        self.started = 0
+        self.cancelled = []
+
+    async def __call__(self):
+        num = self.started
+        self.started += 1
+        try:
+            await asyncio.sleep(self.latencies[num])
+        except asyncio.CancelledError:
+            self.cancelled.append(num)
+            raise
+        return num
+
+
+def run(hedger, calls, histogram=None):
+    async def call():
+        result = await hedger.call(calls, histogram or fast_history(), RateLimiter(), 100)
+        # give the cancelled loser a chance to see its cancellation
+        await asyncio.sleep(0)
+        return result
+    return asyncio.run(call())
+
+
+def test_hedge_wins_and_loser_is_cancelled():
+    hedger = Hedger(enabled=True, budget=1.0)
+    calls = Calls(1.0, 0.01)
+    assert run(hedger, calls) == 1
+    assert (hedger.issued, hedger.won) == (1, 1)
+    assert calls.cancelled == [0]
+
+
+def test_first_request_wins_when_it_answers_in_time():
+    hedger = Hedger(enabled=True, budget=1.0)
+    calls = Calls(0.001, 1.0)
+    assert run(hedger, calls) == 0
+    assert calls.started == 1
+    assert hedger.issued == 0
+
+
+def test_budget_caps_hedges():
+    hedger = Hedger(enabled=True, budget=0.0)
+    calls = Calls(0.1, 0.01)
+    assert run(hedger, calls) == 0
+    assert calls.started == 1
+    assert hedger.issued == 0
+
+
+def test_no_hedge_without_enough_samples():
+    hedger = Hedger(enabled=True, budget=1.0)
+    calls = Calls(0.1, 0.01)
+    assert run(hedger, calls, LatencyHistogram()) == 0
+    assert calls.started == 1
+
+
+def test_deadline_raises_timeout_and_cancels():
+    hedger = Hedger(deadline=0.05)
+    calls = Calls(1.0)
+    with pytest.raises(TimeoutError):
+        run(hedger, calls)
+    assert hedger.timeouts == 1
+    assert calls.cancelled == [0]
+
+
+def test_zero_deadline_waits():
+    hedger = Hedger(deadline=0)
+    assert hedger.deadline is None
+    assert run(hedger, Calls(0.05)) == 0
@@ -0,0 +1,61 @@
+"""Tests of the pdf artifact normalizer and its map back to original offsets."""
+from __future__ import annotations
+
+import time
+
+from doc2quiz import Normalizer as normalizer_module
+from doc2quiz.Normalizer import Normalizer
+
+extracted = """    A -
+me -
+rica’s pop -
+ulation was still about 90 percent
+rural, des -
+pite the flourishing cities. All but 5 percent
+of the people lived east of the Appalachian Moun-
+tains."""
+
+
+def test_artifacts_removed():
+    normalized = Normalizer().normalize(extracted)
+    assert "America’s population was still" in normalized.text
+    assert "Appalachian Mountains." in normalized.text
+    assert "\n" not in normalized.text
+    assert len(normalized.offsets) == len(normalized.text) + 1
+
+
+def test_span_maps_to_original():
+    normalized = Normalizer().normalize(extracted)
+    quote = "America’s population"
+    beg = normalized.text.index(quote)
+    beg_loc, end_loc = normalized.span(beg, beg + len(quote))
+    assert extracted[beg_loc:end_loc] == "A -\nme -\nrica’s pop -\nulation"
+
+    end = len(normalized.text)
+    assert normalized.span(end - len("tains."), end) == (len(extracted) - len("tains."), len(extracted))
+
+
+def test_whitespace_runs_collapse():
+    text = "Growing Pains\n When  the\t\tConstitution"
+    normalized = Normalizer().normalize(text)
+    assert normalized.text == "Growing Pains When the Constitution"
+    beg = normalized.text.index("Pains When")
+    assert text[slice(*normalized.span(beg, beg + len("Pains When")))] == "Pains\n When"
+
+
+def test_joined_words_split(monkeypatch):
+    monkeypatch.setattr(normalizer_module.wordninja, "split",
+                        lambda word: ["spaceflight", "launch"] if word == "spaceflightlaunch" else [word])
+    text = "1. spaceflightlaunch\n2. landing"
+    normalized = Normalizer(split_joined_words=True).normalize(text)
+    assert normalized.text == "1. spaceflight launch 2. landing"
+    beg = normalized.text.index("launch")
+    assert text[slice(*normalized.span(beg, beg + len("launch 2")))] == "launch\n2"
+
+
+def test_normalize_is_linear():
+    chapter = extracted * 2000
+    start = time.perf_counter()
+    normalized = Normalizer().normalize(chapter)
+    assert time.perf_counter() - start < 1.0
+    assert len(normalized.offsets) == len(normalized.text) + 1
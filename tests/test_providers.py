@@ -0,0 +1,127 @@
+"""Offline tests of the provider registry, latency routing and the fake provider."""
+from __future__ import annotations
+
+from collections import defaultdict
+
+import yaml
+from pydantic_yaml import parse_yaml_raw_as
+
+from doc2quiz.ExampleYaml import example_yaml
+from doc2quiz.Providers import FakeChatModel, parse_target, providers
+from doc2quiz.RateLimiter import RateLimiter
+from doc2quiz.Router import LatencyHistogram, Router
+from doc2quiz.Quiz import Quiz
+from doc2quiz.Txt2Yaml import Txt2Yaml
+from doc2quiz.Utils import Config
+
+passage = """
+Cells are the basic unit of life. Robert Hooke first described cells in 1665 while looking
+at cork under a microscope. Matthias Schleiden and Theodor Schwann later proposed that all
+living things are made of cells, and Rudolf Virchow added that cells come from other cells.
+"""
+
+
+def fake_cfg(tmp_path, **kwargs):
+    txt_dir = tmp_path / "txt"
+    txt_dir.mkdir()
+    (txt_dir / "ch1.txt").write_text(passage)
+    (tmp_path / "yaml").mkdir()
+    return Config(platform="fake", model="fake-model", output_dir_txt=str(txt_dir),
+                  output_dir_yaml=str(tmp_path / "yaml"), output_dir_cache=str(tmp_path / "cache"),
+                  manifest_file=str(tmp_path / "manifest.json"), journal_file=str(tmp_path / "journal.json"),
+                  **kwargs)
+
+
+def test_parse_target():
+    assert parse_target("anthropic:claude-3-5-sonnet", "openai") == ("anthropic", "claude-3-5-sonnet")
+    assert parse_target("gpt-4o-mini", "openai") == ("openai", "gpt-4o-mini")
+    # a colon inside a model name isn't a platform
+    assert parse_target("llama3:8b", "ollama") == ("ollama", "llama3:8b")
+
+
+def test_fake_provider_writes_yaml(tmp_path):
+    cfg = fake_cfg(tmp_path)
+    engine = Txt2Yaml(cfg)
+    engine.convert("ch1", "Cells")
+    engine.close_clients()
+
+    content = (tmp_path / "yaml" / "ch1.yaml").read_text()
+    quiz = yaml.safe_load(content)
+    assert quiz["questions"]["items"]
+    assert engine.stats["generated"] == 1
+    assert engine.journal.counts()["done"] == 1
+    assert sum(engine.latency["fake:fake-model"].counts) == 1
+    assert engine.stats["text_tokens"] >= engine.stats["compacted_tokens"] > 0
+
+    # a second run is answered from the manifest without asking the provider
+    engine = Txt2Yaml(cfg)
+    engine.convert("ch1", "Cells")
+    assert engine.stats["skipped"] == 1
+    assert not engine.llm_clients
+    # skipped chapters aren't sent, so they don't count toward the compaction savings
+    assert engine.stats["text_tokens"] == 0
+
+
+def test_routing_uses_every_target(tmp_path, monkeypatch):
+    monkeypatch.setitem(providers, "fake-slow",
+                        lambda model, temperature, *clients: FakeChatModel(model, latency=0.05))
+    cfg = fake_cfg(tmp_path, route=["fake:fast", "fake-slow:slow"], no_llm_cache=True)
+    engine = Txt2Yaml(cfg)
+    for chapter in ("a", "b", "c", "d"):
+        engine.ask_part(chapter, passage, engine.get_initial_prompt(passage))
+
+    # both targets get measured, then the faster one wins
+    assert sum(engine.latency["fake-slow:slow"].counts) == 1
+    assert sum(engine.latency["fake:fast"].counts) == 3
+
+
+def test_router_skips_targets_without_headroom():
+    latency = defaultdict(LatencyHistogram)
+    limiters = {"fast": RateLimiter(rpm=1), "slow": RateLimiter()}
+    router = Router(["fast", "slow"], latency, limiters.get)
+    latency["fast"].add(0.5)
+    latency["slow"].add(5.0)
+
+    assert router.pick(100) == "fast"
+    limiters["fast"].acquire(100)
+    assert router.pick(100) == "slow"
+
+
+def test_rate_limiter_settles_output_tokens():
+    limiter = RateLimiter(tpm=1000, headroom=1.0)
+    limiter.acquire(300)
+    # the answer used 500 tokens, not the 300 reserved for it
+    limiter.settle(300, 500)
+    assert limiter.wait_time(600) > 0
+    # and an overestimate is given back
+    limiter.settle(500, 100)
+    assert limiter.wait_time(800) == 0
+
+
+def test_cascade_check_rejects_made_up_quote(tmp_path):
+    engine = Txt2Yaml(fake_cfg(tmp_path))
+    res = {'raw': None, 'parsed': parse_yaml_raw_as(Quiz, example_yaml), 'parsing_error': None}
+    quotes = [quote for item in res['parsed'].questions.items for quote in item.quotes]
+    assert engine.check_res("\n".join(quotes), res) is None
+
+    # "Sun rises in the west" only shares a few words with this passage
+    text = "\n".join(quote for quote in quotes if "Sun" not in quote)
+    text += "\nthe sun comes up in the morning, goes down in the evening and is west of nothing"
+    assert engine.check_res(text, res) == "quotes text not in the passage: Sun rises in the west"
+
+
+def test_routed_answer_reused_from_cache(tmp_path, monkeypatch):
+    monkeypatch.setitem(providers, "fake-slow",
+                        lambda model, temperature, *clients: FakeChatModel(model, latency=0.05))
+    cfg = fake_cfg(tmp_path, route=["fake:fast", "fake-slow:slow"])
+    engine = Txt2Yaml(cfg)
+    engine.ask_part("a", passage, engine.get_initial_prompt(passage))
+    assert sum(engine.latency["fake:fast"].counts) == 1
+
+    # the router now prefers the other target, but the answer is already on disk
+    engine = Txt2Yaml(cfg)
+    engine.latency["fake:fast"].add(5.0)
+    engine.latency["fake-slow:slow"].add(0.1)
+    engine.ask_part("a", passage, engine.get_initial_prompt(passage))
+    assert engine.stats["llm_requests"] == 0
+    assert list(engine.tier_latency) == ["fake:fast"]
@@ -0,0 +1,181 @@
+"""Tests of quote location in extracted pdf text."""
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from doc2quiz.ExactMatcher import ExactMatcher
+from doc2quiz.MyersMatcher import MyersMatcher
+from doc2quiz.PassageIndex import PassageIndex
+from doc2quiz.Search import Search
+from doc2quiz.Utils import Config
+
+passage = """impo-
+ssible. The eyes of a skeptical world
+were on the upstart United States.
+ Growing Pains
+ When the Constitution was launched in 1789, the
+Rep -
+ublic was continuing to grow at an amazing rate.
+Population was doubling about every twenty-five
+years, and the first official census of 1790 recorded
+almost 4 million people. Cities had blossomed pro-
+portionately: Philadelphia numbered 42,000, New
+York 33,000, Boston 18,000, Charleston 16,000, and
+Baltimore 13,000.
+    A -
+me -
+rica’s pop -
+ulation was still about 90 percent
+rural, des -
+pite the flourishing cities. All but 5 percent
+of the people lived east of the Appalachian Moun-
+tains. The trans-Appalachian overflow was concen-
+tra"""
+
+
+def quiet_search(**kwargs):
+    kwargs.setdefault("no_quote_cache", True)
+    search = Search(Config(**kwargs))
+    search.debug_match = False
+    return search
+
+
+def test_compact_text_keeps_paragraphs():
+    text = "    A -\nme -\nrica’s pop -\nulation was\nrural,  des -\npite the cities.\n \n\n  Moun-\ntains  rise.\n"
+    compacted = quiet_search().compact_text(text)
+    assert compacted == "America’s population was rural, despite the cities.\n\nMountains rise."
+
+
+def test_top_windows_batch():
+    index = PassageIndex(passage)
+    quotes = ["Philadelphia numbered 42,000", "the Constitution was launched in 1789"]
+    windows = index.top_windows(quotes, k=2)
+    assert [len(found) for found in windows] == [2, 2]
+    for quote, found in zip(quotes, windows):
+        assert any(quote in passage[start:end].replace("\n", " ") for start, end, similarity in found)
+        assert found[0][2] >= found[1][2] > 0
+
+
+def test_locate_quotes_maps_back_to_original():
+    quotes = ["America’s population was still about 90 percent rural",
+              "Population was doubling about every twenty-five years",
+              "Quantum chromodynamics explains gluon confinement"]
+    search = quiet_search()
+    locations = search.locate_quotes("test", passage, quotes)
+
+    beg_loc, end_loc, num_err = locations[0]
+    assert passage[beg_loc:end_loc] == "A -\nme -\nrica’s pop -\nulation was still about 90 percent\nrural"
+    assert num_err == 0
+    beg_loc, end_loc, num_err = locations[1]
+    assert passage[beg_loc:end_loc] == "Population was doubling about every twenty-five\nyears"
+    assert locations[2] == (None, None, None)
+    # fuzzy search time is charged to the tier each quote ended in
+    assert search.tier_seconds["missing"] > 0 and search.tier_seconds["fuzzy"] == 0
+
+
+def test_strict_rejects_similar_window():
+    # shares words with the passage but is nowhere near any of its sentences
+    quote = "Boston and Philadelphia doubled the population of the Appalachian cities"
+    search = quiet_search()
+    beg_loc, end_loc, num_err = search.locate_quotes("test", passage, [quote])[0]
+    # only a similar window, there is no edit count to report
+    assert beg_loc is not None and num_err is None
+    assert search.tier_counts["window"] == 1
+    assert search.locate_quotes("test", passage, [quote], strict=True)[0] == (None, None, None)
+
+
+def test_exact_matcher_finds_first_occurrences():
+    matcher = ExactMatcher(["he", "she", "hers", "", "his"])
+    assert matcher.first_matches("ushers and she") == {0: 2, 1: 1, 2: 2}
+
+
+def test_verbatim_quotes_skip_fuzzy_tier():
+    search = quiet_search()
+    quotes = ["Philadelphia numbered 42,000", "america’s population was still", "Boston 18,OOO, Charleston 16,000"]
+    locations = search.locate_quotes("test", passage, quotes)
+    assert passage[locations[0][0]:locations[0][1]] == "Philadelphia numbered 42,000"
+    assert passage[locations[1][0]:locations[1][1]] == "A -\nme -\nrica’s pop -\nulation was still"
+    assert locations[2][2] == 3
+    assert (search.tier_counts["exact"], search.tier_counts["fuzzy"], search.tier_counts["missing"]) == (2, 1, 0)
+
+
+def test_quote_across_line_end_is_exact():
+    search = quiet_search()
+    quotes = ["Growing Pains When the Constitution", "every twenty-five\nyears"]
+    locations = search.locate_quotes("test", passage, quotes)
+    assert passage[locations[0][0]:locations[0][1]] == "Growing Pains\n When the Constitution"
+    assert passage[locations[1][0]:locations[1][1]] == "every twenty-five\nyears"
+    assert search.tier_counts["exact"] == 2
+
+
+def test_quote_locations_cached(tmp_path):
+    quotes = ["Philadelphia numbered 42,000", "Boston 18,OOO, Charleston 16,000",
+              "Quantum chromodynamics explains gluon confinement"]
+    search = quiet_search(no_quote_cache=False, output_dir_cache=str(tmp_path))
+    locations = search.locate_quotes("test", passage, quotes)
+    search.close()
+
+    search = quiet_search(no_quote_cache=False, output_dir_cache=str(tmp_path))
+    assert search.locate_quotes("test", passage, quotes) == locations
+    assert search.tier_counts["cached"] == 3
+    assert search.tier_counts["exact"] + search.tier_counts["fuzzy"] + search.tier_counts["missing"] == 0
+
+    # a new matching algorithm doesn't trust old entries
+    search.algorithm_version += 1
+    search.locate_quotes("test", passage, quotes)
+    assert search.tier_counts["cached"] == 3
+    search.close()
+
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def test_myers_finds_fewest_edits():
+    matcher = MyersMatcher()
+    rng = random.Random(1)
+    for _ in range(500):
+        text = "".join(rng.choice("abc") for _ in range(rng.randint(0, 12)))
+        pattern = "".join(rng.choice("abcd") for _ in range(rng.randint(1, 8)))
+        start, end, edits = matcher.search(text, pattern)
+        fewest = min(edit_distance(pattern, text[i:j]) for i in range(len(text) + 1) for j in range(i, len(text) + 1))
+        assert edits == fewest
+        assert edit_distance(pattern, text[start:end]) == edits
+
+
+def mangle(quote, rng, num_edits):
+    for _ in range(num_edits):
+        pos = rng.randrange(len(quote))
+        action = rng.choice("isd")
+        if action == "i":
+            quote = quote[:pos] + rng.choice("xyz") + quote[pos:]
+        elif action == "s":
+            quote = quote[:pos] + rng.choice("xyz") + quote[pos + 1:]
+        else:
+            quote = quote[:pos] + quote[pos + 1:]
+    return quote
+
+
+def test_myers_matches_regex_backend():
+    pytest.importorskip("regex")
+    text = " ".join(passage.split())
+    myers = quiet_search(match_backend="myers")
+    fuzzy = quiet_search(match_backend="regex")
+    rng = random.Random(2)
+    for _ in range(100):
+        start = rng.randrange(len(text) - 80)
+        quote = mangle(text[start:start + rng.randint(20, 80)], rng, rng.randint(0, 4))
+        myers_loc = myers.find_regex(text, quote)
+        regex_loc = fuzzy.find_regex(text, quote)
+        # ties can pick different spans, the edit count and whether it is found must agree
+        assert myers_loc[2] == regex_loc[2]
+        if myers_loc[0] is not None:
+            assert edit_distance(quote.lower(), text[myers_loc[0]:myers_loc[1]].lower()) == myers_loc[2]
@@ -0,0 +1,40 @@
+"""Tests of splitting oversized sections into balanced requests."""
+from __future__ import annotations
+
+import random
+
+from doc2quiz.SectionSplitter import split_section
+from doc2quiz.Tokens import count_tokens
+
+
+def test_unpunctuated_text_splits_evenly():
+    rng = random.Random(0)
+    words = ["alpha", "beta", "photosynthesis", "mitochondria", "the", "of", "cell", "membrane"]
+    text = " ".join(rng.choice(words) for _ in range(9000))
+    tokens = [count_tokens(part, "gpt-4o") for part in split_section(text, 1000)]
+    assert max(tokens) <= 1000
+    # no small remainder part next to near budget ones
+    assert min(tokens) > 0.8 * max(tokens)
+
+
+def test_paragraphs_stay_whole():
+    paragraphs = [f"Paragraph {num} talks about cells. " * 20 for num in range(10)]
+    parts = split_section("\n\n".join(paragraphs), 600)
+    assert len(parts) > 1
+    assert sorted(paragraph for part in parts for paragraph in part.split("\n\n")) == sorted(paragraphs)
+
+
+def test_sentences_of_one_paragraph_stay_one_paragraph():
+    paragraph = " ".join(f"Sentence {num} explains how the cell membrane works." for num in range(200))
+    text = f"Intro.\n\n{paragraph}\n\nOutro."
+    parts = split_section(text, 300)
+    assert len(parts) > 1
+    assert all(count_tokens(part, "gpt-4o") <= 300 for part in parts)
+    # the cuts are the only changes, sentences are still joined by spaces inside a part
+    assert sum(part.count("\n\n") for part in parts) <= 2
+    assert " ".join(part.replace("\n\n", " ") for part in parts) == text.replace("\n\n", " ")
+
+
+def test_small_text_or_no_budget_is_one_part():
+    assert split_section("a short passage", 1000) == ["a short passage"]
+    assert split_section("a short passage " * 1000, 0) == ["a short passage " * 1000]
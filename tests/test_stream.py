@@ -0,0 +1,76 @@
+"""Offline tests of streamed answers: incremental item parsing, early abort and the --stream flow."""
+from __future__ import annotations
+
+import json
+import asyncio
+
+import pytest
+import yaml
+from pydantic_yaml import parse_yaml_raw_as
+
+from doc2quiz.ExampleYaml import example_yaml
+from doc2quiz.ItemRepair import ItemRepair
+from doc2quiz.ItemStream import ItemStream, StreamAborted
+from doc2quiz.Quiz import Quiz
+from doc2quiz.Txt2Yaml import Txt2Yaml
+from doc2quiz.Utils import Config
+
+
+def example_json():
+    return parse_yaml_raw_as(Quiz, example_yaml).model_dump_json()
+
+
+def test_items_validated_as_they_arrive():
+    seen = []
+    stream = ItemStream(ItemRepair(), on_item=seen.append)
+    answer = example_json()
+    num_items = len(json.loads(answer)["questions"]["items"])
+    for start in range(0, len(answer), 7):
+        stream.feed(answer[start:start + 7])
+        # an item is handed over as soon as its closing brace arrives, before the answer is complete
+        if len(seen) == 1:
+            assert stream.length < len(answer)
+    assert len(seen) == num_items
+    assert stream.text() == answer
+    assert not stream.invalid
+
+
+def test_abort_on_off_schema_items():
+    stream = ItemStream(ItemRepair())
+    bad_item = json.dumps({"type": "true_false", "title": "t", "prompt": "p"})
+    with pytest.raises(StreamAborted):
+        stream.feed('{"questions": {"items": [' + ",".join([bad_item] * 3))
+    assert len(stream.invalid) == 3
+
+
+def test_abort_on_prose():
+    with pytest.raises(StreamAborted):
+        ItemStream(ItemRepair()).feed("Here are the questions you asked for: {")
+
+
+def test_stream_flow_writes_yaml(tmp_path):
+    txt_dir = tmp_path / "txt"
+    txt_dir.mkdir()
+    (txt_dir / "ch1.txt").write_text("Cells are the basic unit of life. " * 10)
+    (tmp_path / "yaml").mkdir()
+    cfg = Config(platform="fake", model="fake-model", stream=True, output_dir_txt=str(txt_dir),
+                 output_dir_yaml=str(tmp_path / "yaml"), output_dir_cache=str(tmp_path / "cache"),
+                 manifest_file=str(tmp_path / "manifest.json"), journal_file=str(tmp_path / "journal.json"))
+    engine = Txt2Yaml(cfg)
+    engine.convert("ch1", "Cells")
+
+    content = (tmp_path / "yaml" / "ch1.yaml").read_text()
+    assert "(in progress)" not in content
+    assert yaml.safe_load(content)["questions"]["items"]
+    assert engine.stats["streams_aborted"] == 0
+    assert engine.stats["streams_with_items"] == 1
+
+
+def test_stream_stops_at_deadline(tmp_path):
+    cfg = Config(platform="fake", model="fake-model", stream=True, request_timeout=0.05,
+                 output_dir_cache=str(tmp_path / "cache"))
+    engine = Txt2Yaml(cfg)
+    engine.get_llm_client().model.latency = 1.0
+    with pytest.raises(TimeoutError):
+        asyncio.run(engine.invoke_llm_stream_async("Cells are the basic unit of life.", "ch1"))
+    assert engine.hedger.timeouts == 1
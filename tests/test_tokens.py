@@ -0,0 +1,23 @@
+"""Tests of local token counting and its fallback estimate."""
+from __future__ import annotations
+
+from doc2quiz import Tokens as tokens_module
+from doc2quiz.Tokens import count_tokens
+
+
+class OfflineTiktoken:
+    """tiktoken as installed on a machine without network access: every encoding needs a download"""
+    def encoding_for_model(self, model):
+        raise KeyError(model)
+
+    def get_encoding(self, name):
+        raise ConnectionError(f"can't download {name}")
+
+
+def test_falls_back_when_encoding_cant_load(monkeypatch):
+    monkeypatch.setattr(tokens_module, "tiktoken", OfflineTiktoken())
+    monkeypatch.setattr(tokens_module, "encodings", {})
+    assert count_tokens("a" * 10, "fake-model") == 3
+    # the failure is remembered, not retried for every count
+    assert tokens_module.encodings == {"fake-model": None}
+    assert count_tokens("abcd", "fake-model") == 1
@@ -0,0 +1,19 @@
+"""Tests of the yaml to xml stage bookkeeping."""
+from __future__ import annotations
+
+from doc2quiz.Utils import Config
+from doc2quiz.Yaml2Xml import Yaml2Xml
+
+
+def test_outputs_include_linked_feedback_images(tmp_path):
+    xml_file_name = tmp_path / "ch1.xml"
+    xml_file_name.write_text('<mattext texttype="text/html">why\n'
+                             '&lt;img src="$IMS-CC-FILEBASE$/Uploaded Media/png/ch1/img01.png"&gt;\n'
+                             '&lt;img src="$IMS-CC-FILEBASE$/Uploaded Media/png/ch1/img02.png"&gt;\n</mattext>')
+    cfg = Config(output_dir_png=str(tmp_path / "png"), manifest_file=str(tmp_path / "manifest.json"))
+    engine = Yaml2Xml(cfg)
+    assert engine.chapter_outputs(str(xml_file_name)) == [
+        str(xml_file_name), f"{tmp_path}/png/ch1/img01.png", f"{tmp_path}/png/ch1/img02.png"]
+
+    cfg.no_feedback_images = True
+    assert engine.chapter_outputs(str(xml_file_name)) == [str(xml_file_name)]